@@ -1,2 +1,3 @@
-from engine import produce, available_artifacts
+from engine import produce, available_artifacts, scheduled_tables
+from engine import table_options
 
@@ -4,9 +4,10 @@
 #Email: tim.tadh@hackthology.com
 #For licensing see the LICENSE file in the top level directory.
 
-import sys
+import sys, collections
 
 from reg import registration
+import lib
 
 INITED = False
 def defered_imports(conf):
@@ -19,11 +20,275 @@ def defered_imports(conf):
 
 def produce(conf):
     '''Create the artifacts requested by the configuration using the various
-    options indicated.
+    options indicated. The trees are streamed through the walkers of the
+    scheduled artifacts once; only artifacts registered with random_access
+    iterate over conf['trees'] again.
     '''
     defered_imports(conf)
-    for name, f in filter_artifacts(conf, available_artifacts(conf)):
-        f(conf)
+    scheduled = filter_artifacts(conf, available_artifacts(conf))
+    names = [name for name, f in scheduled]
+    if registration.random_access(names) and hasattr(conf['trees'], 'retain'):
+        conf['trees'].retain = True
+    with lib.PROFILER.stage('walk') as record:
+        registration.partials = walk(conf, registration.walk(conf, names))
+        walked = lib.PROFILER.counters.pop('walked', dict())
+        record['trees'] = walked.get('trees', 0)
+        record['nodes'] = walked.get('nodes', 0)
+    make(conf, scheduled)
+
+SHARDS_PER_JOB = 4
+
+def walk(conf, walkers):
+    '''Drives the walkers of every scheduled artifact from a single traversal
+    of each tree, instead of having each artifact walk the corpus itself. With
+    conf['jobs'] > 1 the files are walked by a pool of worker processes.
+    @params conf : The configuration created by stat.py
+    @params walkers : map name -> artifacts.tables.generic.Walker
+    @returns : map name -> partial table
+    '''
+    partials = dict((name, registration.identity(name)) for name in walkers)
+    if not walkers: return partials
+    trees = conf['trees']
+    if (conf.get('jobs') or 1) > 1 and hasattr(trees, 'shards'):
+        trees = walk_shards(conf, walkers, partials)
+    traverse(conf, trees, walkers.values())
+    for name, walker in walkers.iteritems():
+        partials[name] = registration.merge(
+            name, partials[name], walker.partial())
+    return partials
+
+def traverse(conf, trees, walkers):
+    '''Walks the trees as configured: with conf['dag'] by drive_dag, otherwise
+    by drive (collapsing identical trees with conf['dedup']).'''
+    if lib.PROFILER.enabled: trees = counted(trees)
+    if conf.get('dag', False):
+        drive_dag(trees, walkers, conf.get('dedup', False))
+    else:
+        drive(trees, walkers, conf.get('dedup', False))
+
+def counted(trees):
+    '''The trees, counted into the "walked" counter of lib.PROFILER (which
+    produce moves into the walk stage).'''
+    for tree in trees:
+        lib.PROFILER.count('walked', trees=1, nodes=len(tree.tree))
+        yield tree
+
+def drive_dag(trees, walkers, collapse=False):
+    '''Hash-conses the trees into an ast.DAG as they are read and runs the
+    walkers which support it (Walker.dag) over its distinct subtrees once all
+    of the trees are in. The other walkers walk each tree as it is read. With
+    collapse the identical trees are added to the DAG once, with all of their
+    corpus positions, just as they are walked once by drive.'''
+    from ast import DAG
+    dag = DAG()
+    def consed(copies):
+        for tree, indices in copies:
+            dag.add(tree, indices)
+            yield tree, indices
+    drive_copies(consed(copies(trees, collapse)),
+                 [w for w in walkers if not w.dag])
+    occurrences = dag.occurrences()
+    for w in walkers:
+        if w.dag: w.walkdag(dag, occurrences)
+
+def dedup(trees):
+    '''Collapses structurally identical trees (see ast.Node.digest) into
+    (tree, indices) pairs, where indices are the positions of the copies in
+    the corpus, in the order of the first copy of each. The distinct trees
+    are held in memory until all of the trees have been read.
+    '''
+    seen = collections.OrderedDict()
+    for i, tree in enumerate(trees):
+        entry = seen.get(tree.digest())
+        if entry is None: seen[tree.digest()] = (tree, [i])
+        else: entry[1].append(i)
+    return seen.itervalues()
+
+def drive(trees, walkers, collapse=False):
+    '''Walks each tree once, calling the callbacks of all of the walkers. With
+    collapse the identical trees are walked once, weighted by their number of
+    copies (see Walker.weight and Walker.indices).'''
+    drive_copies(copies(trees, collapse), walkers)
+
+def copies(trees, collapse=False):
+    '''The trees as (tree, corpus positions) pairs: collapsed by dedup, or
+    each at its own position.'''
+    if collapse: return dedup(trees)
+    return ((tree, (i,)) for i, tree in enumerate(trees))
+
+def drive_copies(copies, walkers):
+    '''Walks each tree of the (tree, corpus positions) pairs once (see
+    drive).'''
+    from tables.generic import walktree
+    processes = tuple(w.process for w in walkers if w.process is not None)
+    finalizers = tuple(w.finalize for w in walkers if w.finalize is not None)
+
+    def process(node, depth):
+        for p in processes:
+            p(node, depth)
+
+    def finalize(node, depth, child_results):
+        return tuple(
+            f(node, depth, [result[i] for result in child_results])
+            for i, f in enumerate(finalizers)
+        )
+
+    if not processes: process = None
+    elif len(processes) == 1: process = processes[0]
+    if not finalizers: finalize = None
+
+    for tree, indices in copies:
+        for w in walkers:
+            w.weight = len(indices)
+            w.indices = indices
+            w.tree(indices[0], tree)
+        walktree(tree, process, finalize)
+
+def walk_shards(conf, walkers, partials):
+    '''Splits the files of the corpus into contiguous shards which are walked
+    by conf['jobs'] worker processes. The partial tables of each shard are
+    merged into `partials` in corpus order.
+    @returns : the trees left for this process to walk (those on stdin)
+    '''
+    import multiprocessing
+    jobs = conf['jobs']
+    trees = conf['trees']
+    wconf = dict(conf)
+    del wconf['trees']
+    pool = multiprocessing.Pool(
+        jobs, initializer=init_worker, initargs=(wconf, walkers.keys()))
+    try:
+        for code, result, counters, entries in pool.imap(
+          walk_shard, trees.shards(jobs*SHARDS_PER_JOB)):
+            if code is not None:
+                sys.exit(code)
+            lib.PROFILER.merge(counters)
+            trees.entries.update(entries)
+            for name, partial in result.iteritems():
+                partials[name] = registration.merge(
+                    name, partials[name], partial)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return trees.stdin_trees()
+
+WORKER = dict()
+def init_worker(conf, names):
+    WORKER['conf'] = conf
+    WORKER['names'] = names
+
+def walk_shard(shard):
+    '''Walks one shard of the corpus in a worker process.
+    @returns : (exit code or None, map name -> partial table, the counters of
+               lib.PROFILER for the shard, the manifest entries of the files
+               read (see stat.Corpus))
+    '''
+    conf = dict(WORKER['conf'], trees=shard)
+    lib.PROFILER.counters = dict()
+    try:
+        walkers = registration.walk(conf, WORKER['names'])
+        traverse(conf, shard, walkers.values())
+    except SystemExit, e:
+        return e.code, None, None, None
+    return None, dict(
+        (name, walker.partial()) for name, walker in walkers.iteritems()
+    ), lib.PROFILER.counters, shard.entries
+
+def make(conf, scheduled):
+    '''Makes the scheduled artifacts, given in a topological order. With
+    conf['jobs'] > 1 up to that many are made at once, each started as soon as
+    the artifacts it depends on are made, so the run takes about as long as
+    its longest chain of dependencies. Each artifact runs in a thread or a
+    forked process as registered (see Registration.execution).
+    @params conf : The configuration created by stat.py
+    @params scheduled : sequence of (name, function)
+    '''
+    jobs = conf.get('jobs') or 1
+    if jobs <= 1:
+        for name, f in scheduled:
+            f(conf)
+        return
+
+    import threading, Queue, multiprocessing
+    functions = dict(scheduled)
+    waiting = [name for name, f in scheduled]
+    depends = dict(
+        (name, set(registration.depends(name)) & set(functions))
+        for name in waiting
+    )
+    done = Queue.Queue() # (name, exc_info or None) as each one finishes
+
+    def thread(name):
+        try:
+            functions[name](conf)
+        except BaseException:
+            done.put((name, sys.exc_info()))
+        else:
+            done.put((name, None))
+
+    def child(name, send):
+        functions[name](conf)
+        send.send(lib.PROFILER.stages.get(name))
+
+    def process(name):
+        recv, send = multiprocessing.Pipe(False)
+        p = multiprocessing.Process(target=child, args=(name, send))
+        p.start()
+        send.close()
+        def join():
+            try:
+                record = recv.recv() # the child's stage for the profile
+                if record is not None: lib.PROFILER.stages[name] = record
+            except EOFError:
+                pass
+            p.join()
+            if p.exitcode == 0: done.put((name, None))
+            else: done.put((name, (SystemExit, SystemExit(p.exitcode), None)))
+        threading.Thread(target=join).start()
+
+    running = 0
+    failed = None
+    while running or (waiting and failed is None):
+        if failed is None:
+            for name in [n for n in waiting if not depends[n]]:
+                if running >= jobs: break
+                waiting.remove(name)
+                if registration.execution(name) == 'process': process(name)
+                else: threading.Thread(target=thread, args=(name,)).start()
+                running += 1
+        try:
+            name, error = done.get(True, 1) # times out so ^C is delivered
+        except Queue.Empty:
+            continue
+        running -= 1
+        if error is not None and failed is None: failed = error
+        for n in waiting:
+            depends[n].discard(name)
+    if failed is not None:
+        raise failed[0], failed[1], failed[2]
+
+def scheduled_tables(conf):
+    '''The names of the tables the configuration will make.'''
+    scheduled = filter_artifacts(conf, available_artifacts(conf))
+    return [
+        name for name, d in registration
+        if d['type'] == 'table' and name in dict(scheduled)
+    ]
+
+def table_options(conf):
+    '''The options which decide what the tables hold (rather than which tables
+    are made), as strings. Tables made with different ones can't be merged.
+    @returns : map option -> value
+    '''
+    defered_imports(conf)
+    from tables.generic import ngram_orders
+    return {
+        'context': str(conf.get('context', 2)),
+        'ngrams': ','.join(str(n) for n in ngram_orders(conf)),
+        'exact_treenums': str(conf.get('exact_treenums', False)).lower(),
+        'top': str(conf.get('top')).lower(),
+    }
 
 def available_artifacts(conf):
     '''Create a dictionary of all of the available artifacts that /could/ be
@@ -77,6 +342,8 @@ class filter_artifacts(object):
             '''Is this a required object?'''
             for use in d['uses']:
                 if not conf[use]: return False
+            for option in d['unless']:
+                if conf.get(option): return False
             if d['name'] in conf['excluded_artifacts']: return False
             elif d['name'] in conf['requested_artifacts']: return True
             elif d['type'] == 'img' and conf['genimgs']: return True
@@ -85,6 +352,8 @@ class filter_artifacts(object):
 
         def allow(d):
             if d['name'] in conf['excluded_artifacts']: return False
+            for option in d['unless']:
+                if conf.get(option): return False
             for use in d['uses']:
                 if conf[use]: continue
                 if conf['list_artifacts']:
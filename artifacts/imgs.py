@@ -4,86 +4,148 @@
 #Email: tim.tadh@hackthology.com
 #For licensing see the LICENSE file in the top level directory.
 
-import sys, os, subprocess, math, warnings
-from decimal import Decimal as dec
+import sys, os, subprocess, math, warnings, hashlib, collections
+import multiprocessing
 
 import reg
-import numpy as np
-from scipy import stats
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
 
-
-
-def dot(name, dotty):
-    dot = name + '.dot'
-    plain = name + '.plain'
-    png = name + '.png'
-
-    f = open(dot, 'w')
-    f.write(dotty)
-    f.close()
-
-    p = subprocess.Popen(['dot', '-Tplain', '-o', plain], stdin=subprocess.PIPE)
-    p.stdin.write(dotty + '\0')
-    p.stdin.close()
-    p.wait()
-
-    p = subprocess.Popen(['dot', '-Tpng', '-o', png], stdin=subprocess.PIPE)
-    p.stdin.write(dotty + '\0')
-    p.stdin.close()
-    p.wait()
-
-def trees(conf):
-    for i, tree in enumerate(conf['trees']):
-        yield i, tree
-
-@reg.registration.register('img', range=trees)
-def ast_imgs(outdir, tables, i, tree):
+def pyplot():
+    '''matplotlib.pyplot on the (non-interactive) Agg backend. Like numpy and
+    scipy everywhere else, matplotlib is imported by the functions which use
+    it rather than at the top of the module, so a run only loads the
+    libraries of what it makes (and listing the artifacts loads none).'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+
+class DotRenderer(object):
+    '''Renders dot graphs to .plain and .png files with one dot process each,
+    at most `jobs` of them running at once. A graph whose text has the same
+    sha1 as when it was last rendered into the directory (see HASHES) is
+    skipped if both its outputs are still there.'''
+
+    HASHES = 'dotty.sha1'
+
+    def __init__(self, outdir, jobs):
+        self.outdir = outdir
+        self.jobs = jobs
+        self.running = collections.deque()
+        self.hashes = dict()
+        self.rendered = dict()
+        path = os.path.join(outdir, self.HASHES)
+        if os.path.isfile(path):
+            f = open(path, 'r')
+            for line in f:
+                if line.strip():
+                    name, digest = line.split()
+                    self.hashes[name] = digest
+            f.close()
+
+    def render(self, name, dotty):
+        digest = hashlib.sha1(dotty).hexdigest()
+        base = os.path.join(self.outdir, name)
+        dot, plain, png = base + '.dot', base + '.plain', base + '.png'
+        if (self.hashes.get(name) == digest and os.path.isfile(plain) and
+            os.path.isfile(png)):
+            self.rendered[name] = digest
+            return
+        self.hashes.pop(name, None)
+
+        f = open(dot, 'w')
+        f.write(dotty)
+        f.close()
+
+        while len(self.running) >= self.jobs:
+            self.reap()
+        p = subprocess.Popen(['dot', '-Tplain', '-o', plain, '-Tpng', '-o', png,
+                              dot])
+        self.running.append((name, digest, p))
+
+    def reap(self):
+        name, digest, p = self.running.popleft()
+        if p.wait() == 0:
+            self.rendered[name] = digest
+
+    def close(self):
+        '''Waits for the running dot processes and saves the hashes of the
+        graphs rendered.'''
+        while self.running:
+            self.reap()
+        f = open(os.path.join(self.outdir, self.HASHES), 'w')
+        for name, digest in sorted(self.rendered.iteritems()):
+            f.write('%s %s\n' % (name, digest))
+        f.close()
+
+@reg.registration.register('img', random_access=True)
+def ast_imgs(outdir, tables, conf):
     if not os.path.exists(outdir):
         os.mkdir(outdir)
-    dot(os.path.join(outdir, str(i)), tree.dotty())
-
-def create_histogram(title, path, table, height=1, shape=None):
+    jobs = conf.get('jobs')
+    if jobs is None: jobs = multiprocessing.cpu_count() # no -j
+    renderer = DotRenderer(outdir, jobs)
+    try:
+        for i, tree in enumerate(conf['trees']):
+            renderer.render(str(i), tree.dotty())
+    finally:
+        renderer.close()
+
+def top_bars(table, bars):
+    '''The (name, count) rows of the table heaviest first, with the rows past
+    the first bars-1 summed into one "other" row.'''
+    table = sorted(table, key=lambda (name, count): count, reverse=True)
+    if len(table) <= bars: return table
+    rest = table[bars-1:]
+    return table[:bars-1] + [('other (%d)' % len(rest),
+                              sum(count for name, count in rest))]
+
+def create_histogram(title, path, table, bars, height=1, shape=None):
     if shape is None: shape = [0.05, .1, 0.90, 0.8]
     fname = path + '.png'
-    table = list(table)
-    table.sort(key=lambda x: x[1])
-    table.reverse()
+    table = top_bars(table, bars)
+    import numpy as np
+    plt = pyplot()
     y = np.array([count for name, count in table])
-    #y = y
 
     fig = plt.figure()
-    ax = fig.add_axes(shape)
+    try:
+        ax = fig.add_axes(shape)
 
-    x = [i for i in xrange(0, len(y))]
-    rects1 = ax.bar(x, y, color='r')
+        x = [i for i in xrange(0, len(y))]
+        rects1 = ax.bar(x, y, color='r')
 
-    ax.set_xlabel('Symbols')
-    ax.set_ylabel('Number of Appearances')
-    labels = tuple(name for name, count in table)
-    ax.set_xlim(0, len(x))
-    ax.set_xticklabels(labels, clip_on=False)
-    xaxis = ax.get_xaxis()
-    xaxis.set_ticks([i+.4 for i in xrange(0, len(y))])
-    xaxis.set_ticklabels(labels)
+        ax.set_xlabel('Symbols')
+        ax.set_ylabel('Number of Appearances')
+        labels = tuple(name for name, count in table)
+        ax.set_xlim(0, len(x))
+        ax.set_xticklabels(labels, clip_on=False)
+        xaxis = ax.get_xaxis()
+        xaxis.set_ticks([i+.4 for i in xrange(0, len(y))])
+        xaxis.set_ticklabels(labels)
 
-    fig.suptitle(title)
-    fig.set_size_inches(int(len(y)*1.2 + .5), 10*height)
-    fig.savefig(fname, format='png')
+        fig.suptitle(title)
+        fig.set_size_inches(int(len(y)*1.2 + .5), 10*height)
+        fig.savefig(fname, format='png')
+    finally:
+        plt.close(fig)
 
 
 @reg.registration.register('img', depends=['symbol_count'])
 def symbol_histogram(path, tables, conf):
-    create_histogram('All Symbols', path, tables['symbol_count'])
+    create_histogram('All Symbols', path, tables['symbol_count'],
+        conf['bars'])
 
 @reg.registration.register('img', depends=['term_count'])
 def term_histogram(path, tables, conf):
-    create_histogram('Terminal Symbols', path, tables['term_count'])
+    create_histogram('Terminal Symbols', path, tables['term_count'],
+        conf['bars'])
 
 @reg.registration.register('img', depends=['non_term_count'])
 def nonterm_histogram(path, tables, conf):
-    create_histogram('Non-Terminal Symbols', path, tables['non_term_count'])
+    create_histogram('Non-Terminal Symbols', path, tables['non_term_count'],
+        conf['bars'])
 
 @reg.registration.register('img', depends=['production_count'])
 def production_histogram(path, tables, conf):
@@ -91,7 +153,8 @@ def production_histogram(path, tables, conf):
         (nonterm + ' =\n' + '\n'.join(c for c in p.split(':')), int(count))
         for nonterm, p, count in tables['production_count']
     ]
-    create_histogram('Productions', path, table, 2, [0.05, .2, 0.90, 0.7])
+    create_histogram(
+        'Productions', path, table, conf['bars'], 2, [0.05, .2, 0.90, 0.7])
 
 @reg.registration.register('img', depends=['production_probability'])
 def production_probability_histogram(path, tables, conf):
@@ -99,16 +162,23 @@ def production_probability_histogram(path, tables, conf):
         (nonterm + ' =\n' + '\n'.join(c for c in p.split(':')), float(count))
         for nonterm, p, count in tables['production_probability']
     ]
-    create_histogram('Productions', path, table, 2, [0.05, .2, 0.90, 0.7])
+    create_histogram(
+        'Productions', path, table, conf['bars'], 2, [0.05, .2, 0.90, 0.7])
 
 @reg.registration.register('img', depends=['tree_number'])
 def normal_probability_plot(path, tables, conf):
+    from scipy import stats
+    plt = pyplot()
     fname = path + '.png'
     treenums = tables['tree_number']
-    x = sorted([float(dec(num).log10()) for ast, num in treenums])
+    x = sorted(row[1] for row in treenums)
     y = [100.0*((j - 0.5)/float(len(x))) for j in xrange(1, len(x)+1)]
-    plt.clf()
-    with warnings.catch_warnings():
-        warnings.simplefilter("ignore")
-        stats.probplot(x, dist='norm', plot=plt)
-    plt.savefig(fname, format='png')
+    fig = plt.figure()
+    try:
+        ax = fig.add_subplot(111)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            stats.probplot(x, dist='norm', plot=ax)
+        fig.savefig(fname, format='png')
+    finally:
+        plt.close(fig)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''A table of the first n primes for the tree numbers. The primes are found
+by a segmented sieve of Eratosthenes over numpy arrays, one fixed size segment
+at a time, and kept for the rest of the run so every tree shares them.
+'''
+
+SEGMENT = 1 << 18
+
+class PrimeTable(object):
+
+    def __init__(self):
+        self.primes = None
+        self.logs = None
+        self.hi = 0 # every prime below hi is in self.primes
+
+    def grow(self, n):
+        '''Sieves segments until the table holds at least n primes.'''
+        import numpy as np
+        if self.primes is None:
+            self.primes = np.array([], dtype=np.int64)
+        while len(self.primes) < n:
+            lo, hi = self.hi, self.hi + SEGMENT
+            composite = np.zeros(hi - lo, dtype=bool)
+            if lo == 0:
+                composite[:2] = True
+                base = xrange(2, int(hi**0.5) + 1)
+            else:
+                base = self.primes[self.primes*self.primes < hi].tolist()
+            for p in base:
+                if lo == 0 and composite[p]: continue
+                start = max(p*p, -(-lo//p)*p)
+                composite[start-lo::p] = True
+            found = np.flatnonzero(~composite).astype(np.int64) + lo
+            self.primes = np.concatenate((self.primes, found))
+            self.hi = hi
+        if self.logs is None or len(self.logs) < len(self.primes):
+            self.logs = np.log10(self.primes.astype(np.float64))
+
+    def first(self, n):
+        '''The first n primes as a numpy int64 array.'''
+        if self.primes is None or len(self.primes) < n: self.grow(n)
+        return self.primes[:n]
+
+    def log10s(self, n):
+        '''The log10 of the first n primes as a numpy float64 array.'''
+        if self.logs is None or len(self.logs) < n: self.grow(n)
+        return self.logs[:n]
+
+PRIMES = PrimeTable()
+
+def product(factors):
+    '''Multiplies the factors pairwise in a balanced tree, so the large
+    multiplications are between numbers of about the same size rather than
+    one huge number and a small one.'''
+    factors = list(factors)
+    if not factors: return 1
+    while len(factors) > 1:
+        paired = [
+            factors[i]*factors[i+1] for i in xrange(0, len(factors) - 1, 2)
+        ]
+        if len(factors) % 2: paired.append(factors[-1])
+        factors = paired
+    return factors[0]
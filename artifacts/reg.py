@@ -6,6 +6,8 @@
 
 import os, sys, functools
 
+import lib
+
 class Registration(object):
 
     types = ['img', 'table']
@@ -13,14 +15,18 @@ class Registration(object):
     def __init__(self):
         self._d = dict()
         self.tables = dict()
+        self.partials = dict()
 
     def init(self, conf):
         self.basepath = conf['outdir']
-        self.loadtables = conf['loadtables']
-        self.loadpath = conf['loadpath']
         self.requested = conf['requested_artifacts']
+        self.format = conf.get('format', 'csv')
 
     def _loadtable(self, name, path, rowloader):
+        columns = os.path.splitext(path)[0] + lib.columnar.EXT
+        if os.path.isdir(columns):
+            self.tables[name] = lib.load_columns(columns)
+            return
         if not (os.path.exists(path) and os.path.isfile(path)): return
         f = open(path, 'r')
         s = f.read()
@@ -32,11 +38,93 @@ class Registration(object):
         )
         self.tables[name] = table
 
+    def walk(self, conf, names):
+        '''Instantiates the walkers of the named artifacts. The walkers are
+        driven by artifacts.engine.walk.
+        @params conf : The configuration created by stat.py
+        @params names : the artifacts scheduled for this run
+        @returns : map name -> walker
+        '''
+        return dict(
+            (name, self._d[name]['walker'](conf))
+            for name in names
+            if self._d[name]['walker'] is not None
+        )
+
+    def identity(self, name):
+        '''A new, empty, partial table for the named artifact.'''
+        return self._d[name]['identity']()
+
+    def merge(self, name, a, b):
+        '''Combines two partial tables of the named artifact. The merge is
+        associative, b is taken to come after a, and may update a in place.
+        @returns : the combined partial table
+        '''
+        return self._d[name]['merge'](a, b)
+
+    def combine(self, name):
+        '''Combines the table loaded by -T with the partial table computed by
+        this run's walk.
+        @returns : the partial table handed to the artifact
+        '''
+        d = self._d[name]
+        table = d['identity']()
+        if self.tables.get(name) is not None:
+            table = d['merge'](table, d['load'](self.tables[name]))
+        if name in self.partials:
+            table = d['merge'](table, self.partials[name])
+        return table
+
+    def random_access(self, names):
+        '''Do any of the named artifacts iterate over conf['trees'] themselves,
+        rather than only seeing the trees through their walker?'''
+        return any(self._d[name]['random_access'] for name in names)
+
+    def depends(self, name):
+        return self._d[name]['depends']
+
+    def execution(self, name):
+        '''How the named artifact is made when artifacts are made
+        concurrently: 'thread' or 'process' (see artifacts.engine.make).'''
+        return self._d[name]['execution']
+
     def register(
-      self, type, range=None, rowloader=None, depends=None, uses=None, ext=None):
+      self, type, range=None, rowloader=None, depends=None, uses=None, ext=None,
+      walker=None, random_access=False, identity=None, merge=None,
+      subtract=None, load=None, unless=None, execution=None):
+        '''Registers an artifact.
+
+        A table artifact computed from the trees supplies a `walker` (see
+        artifacts.tables.generic.Walker) and the algebra of its partial
+        tables: `identity()` makes an empty one and `merge(a, b)` combines two
+        (associatively, b coming after a). `load(table)` turns a table loaded
+        by -T into a partial table. The rows of the loaded table are typed but
+        otherwise as they were saved: either made by `rowloader` from the csv
+        rows, or read from a column directory (see lib.columnar). The engine
+        combines the partial tables of previous runs, shards and batches of
+        trees with these, and the artifact function is called with the result
+        in place of the old table. `subtract(a, b)`, removing b from a, is an
+        extension point which no artifact supplies and the engine does not
+        call: the tables counting a file which has changed are recomputed from
+        scratch instead (see stat.select_files).
+
+        Like `uses`, which lists the configuration options an artifact needs,
+        `unless` lists those which rule it out (eg. the exact tables when
+        their approximate versions are made instead).
+
+        With -j the artifacts whose dependencies are made run concurrently,
+        by `execution`: in a 'thread' of this process, which is what a table
+        needs to hand its result to the artifacts depending on it, or in a
+        forked 'process', which only images may use since nothing depends on
+        them (only the profile of the process is sent back). By default the
+        images drawn from the tables alone are made in processes and
+        everything else in threads.
+        '''
 
         assert hasattr(self, 'basepath')
         assert type in self.types
+        assert walker is None or type == 'table'
+        assert walker is None or (identity is not None and merge is not None)
         def default_range(conf):
             yield (conf,)
         def default_rowloader(row):
@@ -45,6 +133,13 @@ class Registration(object):
         if rowloader is None: rowloader = default_rowloader
         if depends is None: depends = list()
         if uses is None: uses = list()
+        if unless is None: unless = list()
+        if load is None: load = lambda table: table
+        if execution is None:
+            if type == 'img' and not random_access: execution = 'process'
+            else: execution = 'thread'
+        assert execution in ('thread', 'process')
+        assert execution == 'thread' or type == 'img'
         if type == 'table':
             if ext is None:
                 ext = '.csv'
@@ -59,22 +154,30 @@ class Registration(object):
 
             if name in self.requested and self.requested[name] is not None:
                 path = self.requested[name]
-            if type == 'table' and self.loadtables:
-                loadpath = os.path.join(self.loadpath, name) + ext
-                self._loadtable(name, loadpath, rowloader)
 
             @functools.wraps(f)
             def wrapper(conf):
-                for obj in range(conf):
-                    if type == 'img':
-                        f(path, self.tables, *obj)
-                    elif type == 'table':
-                        if name not in self.tables:
-                            self.tables[name] = None
-                        oldtable = self.tables[name]
-                        self.tables[name] = f(path, oldtable, self.tables, *obj)
-                    else:
-                        raise Exception, 'Should be unreachable.'
+                with lib.PROFILER.stage(name) as record:
+                    if type == 'table' and name not in self.tables:
+                        self.tables[name] = None
+                        # -T tables are loaded once the run is known to use
+                        # them (see stat.select_files)
+                        if conf['loadtables']:
+                            self._loadtable(name, os.path.join(
+                                conf['loadpath'], name) + ext, rowloader)
+                    for obj in range(conf):
+                        if type == 'img':
+                            f(path, self.tables, *obj)
+                        elif type == 'table':
+                            oldtable = self.tables[name]
+                            if walker is not None:
+                                oldtable = self.combine(name)
+                            self.tables[name] = f(
+                                path, oldtable, self.tables, *obj)
+                            if isinstance(self.tables[name], (tuple, list)):
+                                record['rows'] = len(self.tables[name])
+                        else:
+                            raise Exception, 'Should be unreachable.'
             self._d.update({
                     name: {
                         'name':name,
@@ -82,6 +185,14 @@ class Registration(object):
                         'function':wrapper,
                         'depends':depends,
                         'uses':set(uses),
+                        'unless':set(unless),
+                        'walker':walker,
+                        'random_access':random_access,
+                        'identity':identity,
+                        'merge':merge,
+                        'subtract':subtract,
+                        'load':load,
+                        'execution':execution,
                     }})
             return wrapper
 
@@ -8,16 +8,26 @@ import sys, os, subprocess, functools, collections
 
 from artifacts.reg import registration
 from artifacts import sieve
+from ast import SYMBOLS
 import lib
 
-from generic import walktree, walktrees, save
+from generic import walktree, walktrees, save, Walker, grammar_index
+from generic import merge_counts
 
-def symbol_counter(path, oldtable, trees, callback):
-    symbols = dict()
-    if oldtable is not None:
-        symbols.update(oldtable)
-    walktrees(trees, functools.partial(callback, symbols))
+class SymbolCounter(Walker):
 
+    dag = True
+
+    def __init__(self, conf):
+        super(SymbolCounter, self).__init__(conf)
+        self.symbols = dict()
+
+    def partial(self):
+        return dict(
+            (SYMBOLS[sym], count) for sym, count in self.symbols.iteritems()
+        )
+
+def symbol_counter(path, symbols):
     return save(path, tuple((name,count)
         for name, count in symbols.iteritems()))
 
@@ -25,50 +35,82 @@ def symcount_rowloader(row):
     name, count = row.split(',')
     return (name, int(count))
 
-@registration.register('table', rowloader=symcount_rowloader)
-def symbol_count(path, oldtable, tables, conf):
-    def callback(symbols, node, depth):
-        symbols[node.label] = symbols.get(node.label, 0) + 1
-    return symbol_counter(path, oldtable, conf['trees'], callback)
-
-@registration.register('table', rowloader=symcount_rowloader)
-def non_term_count(path, oldtable, tables, conf):
-    def callback(symbols, node, depth):
-        if node.children: symbols[node.label] = symbols.get(node.label, 0) + 1
-    return symbol_counter(path, oldtable, conf['trees'], callback)
-
-@registration.register('table', rowloader=symcount_rowloader)
-def term_count(path, oldtable, tables, conf):
-    def callback(symbols, node, depth):
-        if not node.children: symbols[node.label] = symbols.get(node.label, 0) + 1
-    return symbol_counter(path, oldtable, conf['trees'], callback)
-
-@registration.register('table', depends=['infer_grammar'])
-def production_count(path, oldtable, tables, conf):
-    grammar = dict((row[0], tuple(row[1:])) for row in tables['infer_grammar'])
-    stats = dict()
-    prodnum = dict()
-    #print grammar
-    #print "\n"
-    for nonterm, P in grammar.iteritems():
-        for i, p in enumerate(P):
-            prodnum[(nonterm, p)] = i+1
-            stats[(nonterm, i+1)] = 0
-    if oldtable is not None:
-        for nonterm, p, count in oldtable:
-            stats[(nonterm, prodnum[(nonterm, p)])] = int(count)
-    #print prodnum
-    def callback(grammar, stats, node, depth):
+class SymbolCount(SymbolCounter):
+    def process(self, node, depth):
+        symbols = self.symbols
+        symbols[node.sym] = symbols.get(node.sym, 0) + self.weight
+
+class NonTermCount(SymbolCounter):
+    def process(self, node, depth):
+        if not node.children: return
+        symbols = self.symbols
+        symbols[node.sym] = symbols.get(node.sym, 0) + self.weight
+
+class TermCount(SymbolCounter):
+    def process(self, node, depth):
+        if node.children: return
+        symbols = self.symbols
+        symbols[node.sym] = symbols.get(node.sym, 0) + self.weight
+
+symcount_algebra = dict(
+    rowloader=symcount_rowloader, identity=dict, merge=merge_counts,
+    load=dict,
+)
+
+@registration.register('table', walker=SymbolCount, **symcount_algebra)
+def symbol_count(path, symbols, tables, conf):
+    return symbol_counter(path, symbols)
+
+@registration.register('table', walker=NonTermCount, **symcount_algebra)
+def non_term_count(path, symbols, tables, conf):
+    return symbol_counter(path, symbols)
+
+@registration.register('table', walker=TermCount, **symcount_algebra)
+def term_count(path, symbols, tables, conf):
+    return symbol_counter(path, symbols)
+
+class ProductionCount(Walker):
+    '''Counts (nonterm, children) pairs. These are resolved to the productions
+    of the inferred grammar once the walk is done.'''
+
+    dag = True
+
+    def __init__(self, conf):
+        super(ProductionCount, self).__init__(conf)
+        self.counts = dict()
+
+    def process(self, node, depth):
         if not node.children: return
-        productions = grammar[node.label]
-        p = productions.index(':'.join(kid.label for kid in node.children)) + 1
-        #print node.label + " => " + grammar[node.label][p-1]
-        stats[(node.label, p)] += 1
-    walktrees(conf['trees'], functools.partial(callback, grammar, stats))
+        key = (node.sym, tuple(kid.sym for kid in node.children))
+        self.counts[key] = self.counts.get(key, 0) + self.weight
+
+    def partial(self):
+        return dict(
+            ((SYMBOLS[nonterm], tuple(SYMBOLS[kid] for kid in kids)), count)
+            for (nonterm, kids), count in self.counts.iteritems()
+        )
+
+def prodcount_rowloader(row):
+    nonterm, p, count = (col.strip() for col in row.split(','))
+    return (nonterm, p, int(count))
+
+def prodcount_load(table):
+    return dict(
+        ((nonterm, tuple(p.split(':'))), count) for nonterm, p, count in table
+    )
+
+@registration.register('table', depends=['infer_grammar'],
+  walker=ProductionCount, rowloader=prodcount_rowloader, identity=dict,
+  merge=merge_counts, load=prodcount_load)
+def production_count(path, counts, tables, conf):
+    grammar = grammar_index(tables)
+    stats = [0]*len(grammar)
+    for key, count in counts.iteritems():
+        stats[grammar.ids[key]] += count
 
     table = [
-        (key[0], grammar[key[0]][key[1]-1], count)
-        for key, count in stats.iteritems()
+        (grammar.lhs[i], grammar.production(i), count)
+        for i, count in enumerate(stats)
     ]
     table.sort(key=lambda x: (x[0], x[2]))
     save(path, table)
@@ -76,182 +118,283 @@ def production_count(path, oldtable, tables, conf):
 
 @registration.register('table', depends=['production_count', 'infer_grammar'])
 def production_probability(path, oldtable, tables, conf):
-    grammar = dict((row[0], tuple(row[1:])) for row in tables['infer_grammar'])
-    pcount = tuple(tables['production_count'])
-    #print "\n"
-    #print pcount
-    collect = dict()
-
-    prodnum = dict()
-    for nonterm, P in grammar.iteritems():
-        for i, p in enumerate(P):
-            prodnum[(nonterm, p)] = i+1
-
-    for nonterm, p, count in pcount:
-        prods = collect.get(nonterm, dict())
-        prods[p] = count
-        collect[nonterm] = prods
-
-    probabilities = dict(
-        (
-          nonterm,
-          dict(
-            (
-              name,
-              float(count)/float(sum(count for count in prods.itervalues()))
-            )
-            for name, count in prods.iteritems()
-          )
-        )
-        for nonterm, prods in collect.iteritems()
-    )
+    import numpy as np
+    grammar = grammar_index(tables)
+    counts = np.zeros(len(grammar))
+    for nonterm, p, count in tables['production_count']:
+        counts[grammar.ids[(nonterm, tuple(p.split(':')))]] = count
+
+    # the productions of a nonterminal have consecutive ids, so they are
+    # grouped by nonterminal and the backoff prior is uniform within a group
+    groups = np.zeros(len(grammar), dtype=np.int64)
+    outcomes = list()
+    for g, (start, stop) in enumerate(grammar.ranges.itervalues()):
+        groups[start:stop] = g
+        outcomes.append(stop - start)
+    outcomes = np.array(outcomes, dtype=np.float64)
+    probabilities = lib.estimate(
+        groups, counts, conf.get('smoothing'), outcomes=outcomes,
+        prior=1.0/outcomes[groups])
 
     table = tuple(
-        (nonterm, production, probability)
-        for nonterm, prods in probabilities.iteritems()
-            for production, probability in prods.iteritems()
+        (grammar.lhs[i], grammar.production(i), probability)
+        for i, probability in enumerate(probabilities.tolist())
     )
 
     save(path, table)
     return table
 
-@registration.register('table', depends=['infer_grammar'])
-def conditional_counts(path, oldtable, tables, conf):
-    grammar = dict((row[0], tuple(row[1:])) for row in tables['infer_grammar'])
-
-    counts = dict() # counts how many times a RULE is reached by a specific
-                    # prevTuple (e.g. counts[NT => A:B:C][(NT1,NT2)] == 5)
-    nonterminalCounts = dict() # counts how many times a prevTuple reaches a
-                               # specific NONTERMINAL (e.g.
-                               # nonterminalCounts[(NT1,NT2)][NT] == 78)
-    stack = list()
-    lookBack = 2 # how many items in prevTuple?
-
-    def count_nonterms(nonterminalCounts, prevAsTuple, node):
-        if not nonterminalCounts.has_key(prevAsTuple):
-            nonterminalCounts[prevAsTuple] = {node.label : 1}
-        else:
-            if not nonterminalCounts.get(prevAsTuple).has_key(node.label):
-                nonterminalCounts[prevAsTuple][node.label] = 1
-            else:
-                nonterminalCounts[prevAsTuple][node.label] += 1
-
-    def increase_counts(counts, prevAsTuple, chosenRule):
-        if not counts.has_key(chosenRule):
-            counts[chosenRule] = {prevAsTuple : 1}
-        else:
-            if not counts.get(chosenRule).has_key(prevAsTuple):
-                counts[chosenRule][prevAsTuple] = 1
-            else:
-                counts[chosenRule][prevAsTuple] += 1
-
-    def callback(grammar, node, depth):
-        #if this is a new ast then we want to clear our stack
-        if not stack:
-            initStack = (tuple(None for x in range(lookBack)), False)
-            stack.append(initStack)
+class ConditionalCounts(Walker):
+    '''Counts how often each rule is chosen after each context of previous
+    nonterminals, for every context length (order) from 0 to lookBack in the
+    one walk. The counts of a rule are kept in a context trie: its root holds
+    the order 0 count and the child for nonterminal X the count after
+    contexts ending in X, and so on back through the context, so counting a
+    node walks one path of lookBack + 1 trie nodes.
+    '''
 
-        #print stack
-        prev = stack[len(stack)-1][0]
-        requirePop = stack[len(stack)-1][1]
+    def __init__(self, conf):
+        super(ConditionalCounts, self).__init__(conf)
+        self.lookBack = context_order(conf) # how many items in prevTuple?
+        self.counts = dict() # rule -> [count, {nonterm -> [count, {...}]}]
+        self.stack = list()
 
-        prevAsTuple = tuple(prev[x] for x in range(lookBack))
+    def tree(self, i, tree):
+        #this is a new ast so we want to clear our stack
+        initStack = (tuple(None for x in range(self.lookBack)), False)
+        self.stack = [initStack]
 
-        if not node.children:
-            if requirePop:
-                stack.pop()
-            return
+    def process(self, node, depth):
+        stack = self.stack
+        prev, requirePop = stack[-1]
 
         if requirePop:
             stack.pop()
 
-        productions = grammar[node.label]
-        p = productions.index(':'.join(kid.label for kid in node.children)) + 1
-
-        chosenRule = node.label + " => " + grammar[node.label][p-1]
+        if not node.children:
+            return
 
-        increase_counts(counts, prevAsTuple, chosenRule)
-        count_nonterms(nonterminalCounts, prevAsTuple, node)
+        sym = node.sym
+        kids = tuple(kid.sym for kid in node.children)
+        self.count((sym, kids), prev)
 
         #append this new rule to the stack as our new "most previous"
-        if grammar[node.label][p-1].count(":") > 1: #do we have more than 1 nonterminal in this rule?
-            stack.append(
-                (
-                    tuple(prev[x+1] for x in range(lookBack-1)) + (node.label,),
-                    False
-                )
-            )
-        else: #if there is only one nonterminal in this rule then we want to log it as a previous but then pop it from the stack
-              #this way, rules that have >1 nonterminals will keep their "prev" relative to what it was originally.
-              #e.g. with NT:NT2:NT3, when we get to NT2, we dont want previous to include the previous from when we went down NT's productions
-            stack.append(
-                (
-                    tuple(prev[x+1] for x in range(lookBack-1)) + (node.label,),
-                    True
-                 )
-            )
-    for tree in conf['trees']:
-        stack = list()
-        walktree(tree, functools.partial(callback, grammar))
+        #if there is only one nonterminal in this rule then we want to log it
+        #as a previous but then pop it from the stack. this way, rules that
+        #have >1 nonterminals will keep their "prev" relative to what it was
+        #originally. e.g. with NT:NT2:NT3, when we get to NT2, we dont want
+        #previous to include the previous from when we went down NT's
+        #productions
+        if self.lookBack:
+            stack.append((prev[1:] + (sym,), len(kids) <= 2))
+        else:
+            stack.append((prev, len(kids) <= 2))
+
+    def count(self, chosenRule, prev):
+        weight = self.weight
+        node = self.counts.get(chosenRule)
+        if node is None:
+            node = self.counts[chosenRule] = [0, dict()]
+        node[0] += weight
+        for nt in reversed(prev):
+            kids = node[1]
+            node = kids.get(nt)
+            if node is None:
+                node = kids[nt] = [0, dict()]
+            node[0] += weight
+
+    def partial(self):
+        def label(sym):
+            if sym is None: return None
+            return SYMBOLS[sym]
+        counts = dict()
+        for (nonterm, kids), root in self.counts.iteritems():
+            rule = (SYMBOLS[nonterm], tuple(SYMBOLS[kid] for kid in kids))
+            stack = [(root, ())]
+            while stack:
+                (count, children), context = stack.pop()
+                counts[rule + (context,)] = count
+                for nt, child in children.iteritems():
+                    stack.append((child, (label(nt),) + context))
+        return counts
+
+def context_order(conf):
+    '''The longest context of the conditional counts (--context).'''
+    return conf.get('context', 2)
+
+ANY = '*'
+
+def context_columns(context, width):
+    '''The context as `width` columns: padded on the left with ANY, which
+    stands for the nonterminals a shorter context does not condition on.'''
+    return (ANY,)*(width - len(context)) + tuple(context)
+
+def context_from_columns(columns):
+    return tuple(
+        None if nt == 'None' else nt for nt in columns if nt != ANY)
+
+def condcount_rowloader(row):
+    #row format: (order, rule, prev, prev, ..., prev, count)
+    row = [col.strip() for col in row.split(',')]
+    return (int(row[0]),) + tuple(row[1:-1]) + (int(row[-1]),)
+
+def condcount_load(table):
+    counts = dict()
+    for row in table:
+        nonterm, p = row[1].split(' => ', 1)
+        prev = context_from_columns(row[2:-1])
+        key = (nonterm, tuple(p.split(':')), prev)
+        counts[key] = counts.get(key, 0) + row[-1]
+    return counts
+
+@registration.register('table', walker=ConditionalCounts,
+  rowloader=condcount_rowloader, identity=dict, merge=merge_counts,
+  load=condcount_load, unless=['top'])
+def conditional_counts(path, counts, tables, conf):
+    width = max(
+        [context_order(conf)] + [len(prev) for nt, kids, prev in counts])
+
+    # counts how many times a context reaches a specific NONTERMINAL (e.g.
+    # nonterminalCounts[(NT1,NT2)][NT] == 78)
+    nonterminalCounts = dict()
+    for (nonterm, kids, prev), count in counts.iteritems():
+        myCounts = nonterminalCounts.setdefault(prev, dict())
+        myCounts[nonterm] = myCounts.get(nonterm, 0) + count
 
     retTables = dict()
 
-    retTables[0] = tuple(
-        (lookBack, rule) + tuple(nt for nt in prev) + (count,)
-        for rule, myCounts in counts.iteritems()
-            for prev, count in myCounts.iteritems()
-    )
+    retTables[0] = tuple(sorted(
+        (len(prev), nonterm + " => " + ':'.join(kids))
+          + context_columns(prev, width) + (count,)
+        for (nonterm, kids, prev), count in counts.iteritems()
+    ))
 
-    #we don't save this guy as a csv but we need to log it so that conditional_probabilities() can work right
-    retTables[1] = tuple(
-            (lookBack,) + tuple(prev for prev in prevAsTuple) + (nonterm, count)
-            for prevAsTuple, myCounts in nonterminalCounts.iteritems()
-                for nonterm, count in myCounts.iteritems()
-            )
+    #saved by conditional_context_counts
+    retTables[1] = tuple(sorted(
+        (len(prev),) + context_columns(prev, width) + (nonterm, count)
+        for prev, myCounts in nonterminalCounts.iteritems()
+            for nonterm, count in myCounts.iteritems()
+    ))
 
     save(path, retTables[0])
     return retTables
 
+def condcontext_rowloader(row):
+    #row format: (order, prev, prev, ..., prev, nonterm, count)
+    row = [col.strip() for col in row.split(',')]
+    return (int(row[0]),) + tuple(row[1:-1]) + (int(row[-1]),)
+
+@registration.register('table', depends=['conditional_counts'],
+  rowloader=condcontext_rowloader, unless=['top'])
+def conditional_context_counts(path, oldtable, tables, conf):
+    '''How many times each nonterminal follows each context. This is a sum
+    over the conditional counts, which -T has already merged with the trees of
+    this run, so it is rebuilt from them rather than from oldtable.'''
+    table = tables['conditional_counts'][1]
+    save(path, table)
+    return table
 
-@registration.register('table', depends=['conditional_counts', 'infer_grammar'])
-def conditional_probabilities(path, oldtable, tables, conf):
-    dataTables = tables['conditional_counts']
-
-    counts = dict() #counts how many times a RULE is reached by a specific prevTuple (e.g. counts[NT => A:B:C][(NT1,NT2)] == 5)
-    nonterminalCounts = dict() #counts how many times a prevTuple reaches a specific NONTERMINAL (e.g. nonterminalCounts[(NT1,NT2)][NT] == 78)
-
-    lookBack = dataTables[0][0][0] # ...first item in the first row of the first table
-                                   # how many "previous" nonterminals will be in each row? Need this to know what is what in each row
-
-    #dataTables[0] = counts table
-    #dataTables[1] = nontermcounts table
+class TopConditionalCounts(ConditionalCounts):
+    '''ConditionalCounts for --top: the (rule, context) pairs of each order
+    are counted in a lib.HeavyHitters summary for that order instead of
+    exactly.'''
+
+    def __init__(self, conf):
+        super(TopConditionalCounts, self).__init__(conf)
+        self.summaries = [
+            lib.HeavyHitters(conf['top']) for order in xrange(self.lookBack + 1)
+        ]
+
+    def count(self, chosenRule, prev):
+        nonterm, kids = chosenRule
+        summaries = self.summaries
+        for order in xrange(len(prev) + 1):
+            context = prev[len(prev) - order:]
+            summaries[order].add((nonterm, kids, context), self.weight)
+
+    def partial(self):
+        def label(sym):
+            if sym is None: return None
+            return SYMBOLS[sym]
+        return dict(
+            (order, summary.map(lambda (nonterm, kids, prev): (
+                SYMBOLS[nonterm],
+                tuple(SYMBOLS[kid] for kid in kids),
+                tuple(label(nt) for nt in prev),
+            )))
+            for order, summary in enumerate(self.summaries)
+        )
 
-    for row in dataTables[0]:
-        #row format: (lookBack, rule, prev, prev, ..., prev, count) where there are lookBack number of "prev" nonterminals
-        rule = row[1]
-        prevAsTuple = tuple(row[x + 2] for x in range(lookBack))
-        theCount = row[lookBack + 2]
-        if not counts.has_key(rule):
-            counts[rule] = {prevAsTuple : theCount}
-        else:
-            counts[rule][prevAsTuple] = theCount
-
-    for row in dataTables[1]:
-        #row format: (lookBack, prev, prev, ..., prev, nonterm, count) where there are lookBack number of "prev" nonterminals
-        #note: unlike the counts table, this table has no RULES at all. Everything is a nonterminal.
-        prevAsTuple = tuple(row[x + 1] for x in range(lookBack))
-        nonterm = row[lookBack + 1]
-        theCount = row[lookBack + 2]
-        if not nonterminalCounts.has_key(prevAsTuple):
-            nonterminalCounts[prevAsTuple] = {nonterm : theCount}
-        else:
-            nonterminalCounts[prevAsTuple][nonterm] = theCount
+def topcondcount_rowloader(row):
+    #row format: (order, rule, prev, prev, ..., prev, count, error)
+    row = [col.strip() for col in row.split(',')]
+    return (int(row[0]),) + tuple(row[1:-2]) + (int(row[-2]), int(row[-1]))
+
+def topcondcount_load(table):
+    summaries = dict()
+    for row in table:
+        summary = summaries.setdefault(row[0], lib.HeavyHitters())
+        nonterm, p = row[1].split(' => ', 1)
+        prev = context_from_columns(row[2:-2])
+        summary.counts[(nonterm, tuple(p.split(':')), prev)] = row[-2]
+        summary.total += row[-2]
+        summary.error = max(summary.error, row[-1])
+    return summaries
+
+@registration.register('table', uses=['top'], walker=TopConditionalCounts,
+  rowloader=topcondcount_rowloader, identity=dict,
+  merge=lib.merge_heavy_hitters, load=topcondcount_load)
+def top_conditional_counts(path, summaries, tables, conf):
+    '''The heaviest rows of conditional_counts of each order, with the error
+    of their counts (the true count is between count and count + error)
+    appended.'''
+    tops = [(order, summaries[order]) for order in sorted(summaries)]
+    tops = [(summary.top(), summary.error) for order, summary in tops]
+    width = max([context_order(conf)] + [
+        len(prev) for top, error in tops for (n, k, prev), c in top])
+    table = tuple(
+        (len(prev), nonterm + " => " + ':'.join(kids))
+          + context_columns(prev, width) + (count, error)
+        for top, error in tops
+        for (nonterm, kids, prev), count in top
+    )
+    save(path, table)
+    return table
 
+@registration.register('table', depends=['conditional_counts', 'infer_grammar'],
+  unless=['top'])
+def conditional_probabilities(path, oldtable, tables, conf):
+    import numpy as np
+    dataTables = tables['conditional_counts']
+    grammar = grammar_index(tables)
+    smoothing = conf.get('smoothing')
+
+    #dataTables[0] = counts table, row format:
+    #    (order, rule, prev, prev, ..., prev, count)
+    #every order of context is in the same table, the contexts are padded to
+    #the same number of columns with ANY. the rules of a nonterminal after a
+    #context form a group, P[rule | prev] is the rule's share of its group.
+    rows = dataTables[0]
+    index = dict() # (prev, rule) -> row
+    groups = dict() # (prev, nonterm) -> group
+    group = np.zeros(len(rows), dtype=np.int64)
+    outcomes = list() # the number of rules of the nonterminal of each group
+    for i, row in enumerate(rows):
+        rule, prev = row[1], row[2:-1]
+        nonterm = rule[:rule.index(' => ')]
+        index[(prev, rule)] = i
+        group[i] = groups.setdefault((prev, nonterm), len(groups))
+        if group[i] == len(outcomes):
+            start, stop = grammar.ranges.get(nonterm, (0, 1))
+            outcomes.append(stop - start)
+    outcomes = np.array(outcomes, dtype=np.float64)
+    counts = np.array([row[-1] for row in rows], dtype=np.float64)
+    orders = np.array([row[0] for row in rows], dtype=np.int64)
 
     '''
     output csv format looks like this:
 
-    lookBack, rule, prev, prev, .., prev, probability
+    order, rule, prev, prev, .., prev, probability
 
     the probability is a conditional probability: P[rule | prev]
 
@@ -283,27 +426,33 @@ def conditional_probabilities(path, oldtable, tables, conf):
         Pr(B=r:C | S A B) = Pr(B=r:C, S A B)/Pr(S A B)
                         = 6/10
 
+    With backoff smoothing the estimate for a context is mixed with the one
+    for the context without its oldest nonterminal (and at order 0 with the
+    uniform choice between the rules of the nonterminal).
     '''
 
-    probabilities = dict(
-        (
-          rule,
-          dict(
-            (
-              prev,
-              float(num)/float(nonterminalCounts[prev][rule.split("=>")[0].strip()]) #P[rule | prev]
-            )
-            for prev, num in myCounts.iteritems()
-          )
-        )
-        for rule, myCounts in counts.iteritems()
-    )
-
-    table = tuple(
-        (lookBack, prod) + tuple(nt for nt in prev) + (probability,)
-        for prod, myCounts in probabilities.iteritems()
-            for prev, probability in myCounts.iteritems()
-    )
+    probabilities = np.zeros(len(rows))
+    uniform = 1.0/outcomes[group]
+    for order in sorted(set(orders.tolist())):
+        rowsof = np.flatnonzero(orders == order)
+        prior = uniform[rowsof]
+        if order > 0 and smoothing is not None and smoothing[0] == 'backoff':
+            prior = prior.copy()
+            for j, i in enumerate(rowsof.tolist()):
+                row = rows[i]
+                prev = row[2:-1]
+                oldest = len(prev) - order
+                shorter = prev[:oldest] + (ANY,) + prev[oldest+1:]
+                lower = index.get((shorter, row[1]))
+                if lower is not None: prior[j] = probabilities[lower]
+        probabilities[rowsof] = lib.estimate(
+            group[rowsof], counts[rowsof], smoothing, outcomes=outcomes,
+            prior=prior)
+
+    table = tuple(sorted(
+        (row[0], row[1]) + row[2:-1] + (probability,)
+        for row, probability in zip(rows, probabilities.tolist())
+    ))
 
     save(path, table)
-    return table
\ No newline at end of file
+    return table
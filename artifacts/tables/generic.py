@@ -4,30 +4,156 @@
 #Email: tim.tadh@hackthology.com
 #For licensing see the LICENSE file in the top level directory.
 
-import sys, os, subprocess, functools, collections
+import sys, os, subprocess, functools, collections, shutil
+from array import array
+from decimal import Decimal
 
 from artifacts.reg import registration
-from artifacts import sieve
+from artifacts.primes import PRIMES, product
+from ast import SYMBOLS
 import lib
+from lib.columnar import EXT as COLUMNS_EXT
 
 def walktree(root, process=None, finalize=None):
-    def default(*args):
-        pass
-    stack = list()
-    if finalize is None: finalize = default
-    if process is None: process = default
-    #stack.append((root, functools.partial(finalize, root)))
-    def visit(node, depth):
-        process(node, depth)
-        child_results = [visit(child, depth+1) for child in node.children]
-        return finalize(node, depth, child_results)
-    return visit(root, 1)
+    '''Walks the tree depth first with an explicit stack, so trees deeper than
+    the recursion limit can be walked. process(node, depth) is called on the
+    way down (pre-order) and finalize(node, depth, child_results) on the way
+    up (post-order) with the results of finalize for each child. The root is
+    at depth 1. Each node is released (see ast.Node.release) once the walk
+    is done with it.
+    @returns : the result of finalize for the root
+    '''
+    if finalize is None:
+        if process is None: return None
+        stack = [(root, 1)]
+        while stack:
+            node, depth = stack.pop()
+            process(node, depth)
+            depth += 1
+            stack.extend((kid, depth) for kid in reversed(node.children))
+            node.release()
+        return None
+    if process is not None: process(root, 1)
+    stack = [(root, 1, iter(root.children))]
+    results = [list()]
+    while stack:
+        node, depth, kids = stack[-1]
+        for kid in kids:
+            if process is not None: process(kid, depth+1)
+            stack.append((kid, depth+1, iter(kid.children)))
+            results.append(list())
+            break
+        else:
+            stack.pop()
+            result = finalize(node, depth, results.pop())
+            node.release()
+            if not results: return result
+            results[-1].append(result)
 
 def walktrees(trees, process):
     for tree in trees:
         walktree(tree, process)
 
+class Walker(object):
+    '''The per node half of a table artifact. The walkers of all of the
+    scheduled artifacts are driven from a single traversal of each tree (see
+    artifacts.engine.walk). Subclasses override `process` and/or `finalize`,
+    which have the same signatures as the callbacks of walktree, and
+    `partial`, which returns what the walker counted in the form its artifact
+    registered an identity and merge for.
+
+    When identical trees are collapsed (conf['dedup']) each distinct tree is
+    walked once. Before `tree` is called `indices` is set to the positions of
+    its copies in the corpus and `weight` to their number. Counting walkers
+    add `weight` rather than 1 and per tree walkers put their result at each
+    of the `indices`, so their tables stay in corpus order.
+
+    Walkers whose `process` only looks at a node and its children (not the
+    depth or the rest of the tree) set `dag`. When the corpus is hash-consed
+    (conf['dag']) they are run over each distinct subtree of the DAG by
+    `walkdag` rather than over every node of every tree.
+    '''
+
+    process = None
+    finalize = None
+    weight = 1
+    indices = None
+    dag = False
+
+    def __init__(self, conf):
+        self.conf = conf
+
+    def tree(self, i, tree):
+        '''Called before the i'th tree is walked.'''
+        pass
+
+    def partial(self):
+        '''The partial table of the trees walked so far.'''
+        raise NotImplementedError
+
+    def walkdag(self, dag, occurrences):
+        '''Calls process once for each distinct subtree of the ast.DAG, with
+        `weight` set to the number of times it occurs in the trees.'''
+        for i, count in enumerate(occurrences):
+            self.weight = count
+            self.process(dag.node(i), None)
+
+def merge_counts(a, b):
+    '''Adds the counts in b to those in a (both map key -> count).
+    @returns : a
+    '''
+    for key, count in b.iteritems():
+        a[key] = a.get(key, 0) + count
+    return a
+
+def merge_sets(a, b):
+    '''Unions the sets in b into those in a (both map key -> set).
+    @returns : a
+    '''
+    for key, items in b.iteritems():
+        a.setdefault(key, set()).update(items)
+    return a
+
+def in_corpus_order(indices, results):
+    '''The per tree results of a walker as a list in corpus order.
+    @params indices : the corpus indices of the trees of each result
+    @params results : a result for each distinct tree walked
+    '''
+    placed = [(i, k) for k, at in enumerate(indices) for i in at]
+    placed.sort()
+    return [results[k] for i, k in placed]
+
+def merge_lists(a, b):
+    '''Appends b to a. For per tree tables, b's trees follow a's.
+    @returns : a
+    '''
+    a.extend(b)
+    return a
+
+INDEX = dict()
+
+def grammar_index(tables):
+    '''The infer_grammar table compiled into a lib.GrammarIndex. It is only
+    compiled once per run and shared by the artifacts depending on it.'''
+    table = tables['infer_grammar']
+    cached = INDEX.get('cached') # (table, index), replaced as a whole since
+                                 # the artifacts may run in threads
+    if cached is None or cached[0] is not table:
+        cached = INDEX['cached'] = (table, lib.GrammarIndex.from_table(table))
+    return cached[1]
+
 def save(path, table):
+    '''Saves the table at path as csv or, with "-f cols", as a column
+    directory (see lib.columnar) next to it.
+    @returns : the table
+    '''
+    columns = os.path.splitext(path)[0] + COLUMNS_EXT
+    # the table in the other format, if an earlier run left one, is now stale
+    # and must not be what -T loads
+    if registration.format == 'cols':
+        if os.path.isfile(path): os.remove(path)
+        return lib.save_columns(columns, table)
+    if os.path.isdir(columns): shutil.rmtree(columns)
     s = '\n'.join( ', '.join(str(col) for col in row) for row in table )
     f = open(path, 'w')
     f.write(s)
@@ -35,70 +161,287 @@ def save(path, table):
     f.close()
     return table
 
-@registration.register('table')
+class NGrams(Walker):
+    '''Counts the vertical n-grams of each tree: the labels of the paths of N
+    nodes down the tree, for each N in `orders` at once. The labels of the
+    ancestors of the current node are kept as a window (`path`) which process
+    rolls forward, so the n-grams ending at a node are slices of it.
+    '''
+
+    dag = True
+
+    def __init__(self, conf):
+        super(NGrams, self).__init__(conf)
+        self.orders = ngram_orders(conf)
+        self.counts = list() # gram -> count, for each distinct tree
+        self.indices_of = list() # the corpus indices of each distinct tree
+        self.path = list()
+
+    def tree(self, i, tree):
+        self.counts.append(dict())
+        self.indices_of.append(self.indices or (i,))
+
+    def process(self, node, depth):
+        path = self.path
+        del path[depth-1:]
+        path.append(node.sym)
+        counts = self.counts[-1]
+        for n in self.orders:
+            if n > depth: break
+            gram = tuple(path[depth-n:])
+            counts[gram] = counts.get(gram, 0) + 1
+
+    def partial(self):
+        return in_corpus_order(
+            self.indices_of,
+            [dict(
+                (tuple(SYMBOLS[sym] for sym in gram), count)
+                for gram, count in counts.iteritems()
+            ) for counts in self.counts]
+        )
+
+    def walkdag(self, dag, occurrences):
+        '''Each n-gram is counted from its top node instead: the grams down
+        from a distinct subtree are found once for the corpus and counted as
+        many times as the subtree occurs in the tree. Trees with the same
+        root share their counts.'''
+        paths = dag_grams(dag, self.orders)
+        trees = dict()
+        for root, indices in zip(dag.roots, dag.copies):
+            self.indices = indices
+            self.tree(indices[0], dag.node(root))
+            if root in trees:
+                self.counts[-1] = trees[root]
+                continue
+            seen = set([root])
+            stack = [root]
+            while stack:
+                for j in dag.kids[stack.pop()]:
+                    if j not in seen:
+                        seen.add(j)
+                        stack.append(j)
+            within = dict.fromkeys(seen, 0)
+            within[root] = 1
+            counts = self.counts[-1]
+            for i in sorted(seen, reverse=True):
+                for j in dag.kids[i]:
+                    within[j] += within[i]
+                for gram in paths(i):
+                    counts[gram] = counts.get(gram, 0) + within[i]
+            trees[root] = counts
+
+class TopNGrams(NGrams):
+    '''NGrams for --top: the n-grams of the whole corpus are counted in a
+    lib.HeavyHitters summary for each length, instead of exactly per tree.'''
+
+    def __init__(self, conf):
+        super(TopNGrams, self).__init__(conf)
+        self.summaries = dict(
+            (n, lib.HeavyHitters(conf['top'])) for n in self.orders)
+
+    def tree(self, i, tree):
+        pass
+
+    def process(self, node, depth):
+        path = self.path
+        del path[depth-1:]
+        path.append(node.sym)
+        for n in self.orders:
+            if n > depth: break
+            self.summaries[n].add(tuple(path[depth-n:]), self.weight)
+
+    def partial(self):
+        def label(gram):
+            return tuple(SYMBOLS[sym] for sym in gram)
+        return dict(
+            (n, summary.map(label)) for n, summary in self.summaries.iteritems()
+        )
+
+    def walkdag(self, dag, occurrences):
+        paths = dag_grams(dag, self.orders)
+        summaries = self.summaries
+        for i, count in enumerate(occurrences):
+            for gram in paths(i):
+                summaries[len(gram)].add(gram, count)
+
+def dag_grams(dag, orders):
+    '''@returns : a function giving the n-grams (of the lengths in orders)
+                  going down from a node of the ast.DAG, each found once.'''
+    down = dict()
+    def paths(i):
+        if i not in down:
+            grams = list()
+            level = [(dag.labels[i],)]
+            ends = [i]
+            for n in xrange(1, orders[-1] + 1):
+                if n in orders: grams.extend(level)
+                if n == orders[-1]: break
+                level, ends = (
+                    [gram + (dag.labels[k],)
+                      for gram, j in zip(level, ends) for k in dag.kids[j]],
+                    [k for j in ends for k in dag.kids[j]],
+                )
+            down[i] = grams
+        return down[i]
+    return paths
+
+def ngram_orders(conf):
+    '''The n-gram lengths to count: those of --ngrams, and always 3 for
+    prod_3grams.'''
+    return sorted(set(conf.get('ngrams') or ()) | set([3]))
+
+def ngram_rowloader(row):
+    tree, n, gram, count = (col.strip() for col in row.split(','))
+    return (int(tree), int(n), gram, int(count))
+
+def ngram_load(table):
+    grams = [dict() for i in xrange(max([row[0] for row in table] or [-1]) + 1)]
+    for tree, n, gram, count in table:
+        grams[tree][tuple(gram.split(':'))] = count
+    return grams
+
+@registration.register('table', walker=NGrams, rowloader=ngram_rowloader,
+  identity=list, merge=merge_lists, load=ngram_load, unless=['top'])
+def ngram_counts(path, grams, tables, conf):
+    table = [
+        (i, len(gram), ':'.join(gram), count)
+        for i, counts in enumerate(grams)
+        for gram, count in counts.iteritems()
+    ]
+    table.sort()
+    save(path, table)
+    return table
+
+@registration.register('table', depends=['ngram_counts'], unless=['top'])
+def corpus_ngram_counts(path, oldtable, tables, conf):
+    counts = dict()
+    for i, n, gram, count in tables['ngram_counts']:
+        counts[(n, gram)] = counts.get((n, gram), 0) + count
+    table = [(n, gram, count) for (n, gram), count in counts.iteritems()]
+    table.sort()
+    save(path, table)
+    return table
+
+@registration.register('table', depends=['ngram_counts'], unless=['top'])
 def prod_3grams(path, oldtable, tables, conf):
-    trees = conf['trees']
-
-    class Callback(object):
-
-        def __init__(self, N):
-            self.N = N
-            self.grams = set()
-
-        def __call__(self, node, depth, child_results):
-            mygrams = set(((node.label, ), ))
-            for child in child_results:
-                for gram in child:
-                    if len(gram) < self.N:
-                        newgram = tuple([node.label] + list(gram))
-                    else:
-                        assert len(gram) == self.N
-                        newgram = tuple([node.label] + list(gram[:-1]))
-                    if len(newgram) == self.N:
-                        self.grams.add(newgram)
-                    mygrams.add(newgram)
-            return mygrams
-
-    grams = list()
-    for tree in trees:
-        cback = Callback(3)
-        walktree(tree, finalize=cback)
-        grams.append(cback.grams)
+    table = [
+        (i,) + tuple(gram.split(':'))
+        for i, n, gram, count in tables['ngram_counts'] if n == 3
+    ]
+    table.sort()
+    save(path, table)
+    return table
+
+def topgram_rowloader(row):
+    n, gram, count, error = (col.strip() for col in row.split(','))
+    return (int(n), gram, int(count), int(error))
 
+def topgram_load(table):
+    summaries = dict()
+    for n, gram, count, error in table:
+        summary = summaries.setdefault(n, lib.HeavyHitters())
+        summary.counts[tuple(gram.split(':'))] = count
+        summary.total += count
+        summary.error = max(summary.error, error)
+    return summaries
+
+@registration.register('table', uses=['top'], walker=TopNGrams,
+  rowloader=topgram_rowloader, identity=dict, merge=lib.merge_heavy_hitters,
+  load=topgram_load)
+def top_ngram_counts(path, summaries, tables, conf):
+    '''The heaviest n-grams of each length in the corpus, as rows of (n,
+    gram, count, error): the true count is between count and count + error.'''
     table = [
-      [X] + list(Z)
-      for X, Y in enumerate(grams)
-      for Z in Y
+        (n, ':'.join(gram), count, summaries[n].error)
+        for n in sorted(summaries)
+        for gram, count in summaries[n].top()
     ]
-    for x in xrange(len(table[0])-1, -1, -1):
-        table.sort(key=lambda row: row[x])
     save(path, table)
     return table
 
 
-@registration.register('table')
-def tree_number(path, oldtable, tables, conf):
+class TreeNumber(Walker):
+    '''The tree number of a tree is the product, over its nodes in pre-order,
+    of the i'th prime raised to the number of children of the i'th node. It is
+    computed as its log10, the exact number is only computed (as a balanced
+    product) when conf['exact_treenums'] is set. The child counts of the
+    current tree are collected by process and turned into its number when the
+    next tree starts.
+    '''
+
+    def __init__(self, conf):
+        super(TreeNumber, self).__init__(conf)
+        self.exact = conf.get('exact_treenums', False)
+        self.numbers = list() # (log10, exact number or None) per tree
+        self.indices_of = list()
+        self.kids = None
+
+    def tree(self, i, tree):
+        self.flush()
+        self.kids = array('i')
+        self.indices_of.append(self.indices or (i,))
 
-    class callback(object):
+    def process(self, node, depth):
+        self.kids.append(len(node.children))
 
-        def __init__(self):
-            self.acc = 1
-            self.primes = sieve.find_primes()
+    def flush(self):
+        if self.kids is None: return
+        self.numbers.append(treenum(self.kids, self.exact))
+        self.kids = None
 
-        def __call__(self, node, depth):
-            self.acc *= self.primes.next()**(len(node.children))
+    def partial(self):
+        self.flush()
+        return in_corpus_order(self.indices_of, self.numbers)
 
-        def number(self):
-            return self.acc
+def treenum(kids, exact=False):
+    '''The tree number of a tree from the child counts of its nodes.
+    @params kids : the number of children of each node in pre-order
+    @params exact : also compute the exact number
+    @returns : (log10, exact number or None)
+    '''
+    import numpy as np
+    n = len(kids)
+    log = float(np.dot(np.array(kids, dtype=np.float64), PRIMES.log10s(n)))
+    if not exact: return (log, None)
+    return (log, product(
+        p**k for p, k in zip(PRIMES.first(n).tolist(), kids) if k
+    ))
 
+def treenum_column(col):
+    if col == 'None': return None
+    if col.isdigit(): return int(col)
+    return float(col)
+
+def treenum_rowloader(row):
+    row = [col.strip() for col in row.split(',')]
+    return (int(row[0]),) + tuple(treenum_column(col) for col in row[1:])
+
+def treenum_load(table):
+    '''Rows are (tree, log10) or (tree, log10, exact). Tables from before the
+    log10 form are (tree, exact).'''
     numbers = list()
-    trees = conf['trees']
-    for tree in trees:
-        c = callback()
-        walktree(tree, c)
-        numbers.append(c.number())
+    for row in sorted(table):
+        log, exact = row[1], (row[2] if len(row) > 2 else None)
+        if isinstance(log, (int, long)): log, exact = None, log
+        if exact == 'None': exact = None
+        if exact is not None: exact = int(exact)
+        if log is None: log = float(Decimal(exact).log10())
+        numbers.append((log, exact))
+    return numbers
 
-    table = tuple((i, n) for i, n in enumerate(numbers))
+@registration.register('table', walker=TreeNumber, rowloader=treenum_rowloader,
+  identity=list, merge=merge_lists, load=treenum_load)
+def tree_number(path, numbers, tables, conf):
+    if not conf.get('exact_treenums', False):
+        table = tuple((i, log) for i, (log, exact) in enumerate(numbers))
+    else:
+        if any(exact is None for log, exact in numbers):
+            print >>sys.stderr, (
+              'WARNING: some tree numbers loaded from "%s" have no exact value'
+            ) % conf['loadpath']
+        table = tuple(
+            (i, log, exact) for i, (log, exact) in enumerate(numbers)
+        )
     save(path, table)
     return table
 
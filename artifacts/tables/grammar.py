@@ -8,27 +8,46 @@ import sys, os, subprocess, functools, collections
 
 from artifacts.reg import registration
 from artifacts import sieve
+from ast import SYMBOLS
 import lib
 
-from generic import walktree, walktrees, save
+from generic import walktree, walktrees, save, Walker, merge_sets
 
-@registration.register('table', ext='.grammar')
-def infer_grammar(path, oldtable, tables, conf):
-    productions = dict()
-    if oldtable is not None:
-        ## TODO: clean this jankyness up! we shouldn't have to rejoin oldtable
-        ## so we can parse it.
-        productions.update(
-          lib.parse_grammar('\n'.join(''.join(row) for row in oldtable))
+class InferGrammar(Walker):
+
+    dag = True
+
+    def __init__(self, conf):
+        super(InferGrammar, self).__init__(conf)
+        self.productions = dict()
+
+    def partial(self):
+        return dict(
+            (SYMBOLS[nonterm], set(tuple(SYMBOLS[sym] for sym in p) for p in P))
+            for nonterm, P in self.productions.iteritems()
         )
 
-    def callback(productions, node, depth):
+    def process(self, node, depth):
         if not node.children: return
-        p = productions.get(node.label, set())
-        p.add(tuple(kid.label for kid in node.children))
-        productions[node.label] = p
-    walktrees(conf['trees'], functools.partial(callback, productions))
+        p = self.productions.get(node.sym)
+        if p is None:
+            p = self.productions[node.sym] = set()
+        p.add(tuple(kid.sym for kid in node.children))
+
+def grammar_rowloader(row):
+    nonterm, prod = row.split(':', 1)
+    return (nonterm.strip(), tuple(p.strip() for p in prod.split()))
+
+def grammar_load(table):
+    productions = dict()
+    for nonterm, p in table:
+        productions.setdefault(nonterm, set()).add(p)
+    return productions
 
+@registration.register('table', ext='.grammar', walker=InferGrammar,
+  rowloader=grammar_rowloader, identity=dict, merge=merge_sets,
+  load=grammar_load)
+def infer_grammar(path, productions, tables, conf):
     table = tuple(
         tuple([nonterm] + [':'.join(p) for p in P])
         for nonterm, P in productions.iteritems()
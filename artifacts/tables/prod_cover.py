@@ -15,27 +15,18 @@ from generic import walktree, walktrees
 
 def callback(grammar, cov, node, depth):
     if not node.children: return
-    productions = grammar[node.label]
-    p = productions.index(':'.join(kid.label for kid in node.children)) + 1
+    p = grammar.number(node.label, tuple(kid.label for kid in node.children))
     cov[(node.label, p)] = 1
 
 #@registration.register('table', depends=['grammar'])
 def production_coverage_local(path, oldtable, tables, conf):
-    grammar = dict(
-      (
-        nonterm,
-        tuple(sorted(':'.join(p) for p in prods))
-      )
-      for nonterm, prods in conf['grammar'].iteritems()
-    )
+    grammar = lib.GrammarIndex.from_grammar(conf['grammar'])
     def initstats():
         stats = dict()
-        total = 0
-        for nonterm, P in grammar.iteritems():
-            for i, p in enumerate(P):
+        for nonterm, (start, stop) in grammar.ranges.iteritems():
+            for i in xrange(stop - start):
                 stats[(nonterm, i+1)] = 0
-                total += 1
-        return stats, total
+        return stats, len(grammar)
 
     for tree in conf['trees']:
         local_cov, total = initstats()
@@ -44,21 +35,13 @@ def production_coverage_local(path, oldtable, tables, conf):
 
 #@registration.register('table', depends=['grammar'])
 def production_coverage_global(path, oldtable, tables, conf):
-    grammar = dict(
-      (
-        nonterm,
-        tuple(sorted(':'.join(p) for p in prods))
-      )
-      for nonterm, prods in conf['grammar'].iteritems()
-    )
+    grammar = lib.GrammarIndex.from_grammar(conf['grammar'])
     def initstats():
         stats = dict()
-        total = 0
-        for nonterm, P in grammar.iteritems():
-            for i, p in enumerate(P):
+        for nonterm, (start, stop) in grammar.ranges.iteritems():
+            for i in xrange(stop - start):
                 stats[(nonterm, i+1)] = 0
-                total += 1
-        return stats, total
+        return stats, len(grammar)
 
 
     global_cov, total = initstats()
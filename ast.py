@@ -4,13 +4,18 @@
 #Email: tim.tadh@hackthology.com
 #For licensing see the LICENSE file in the top level directory.
 
-import collections
+import re, hashlib, collections
+from array import array
 
 def build_tree(gen):
     stack = list()
     root = None
     for children, sym in gen:
+        value = None
+        if not children and ':' in sym:
+            sym, value = sym.split(':', 1)
         node = Node(sym)
+        node.value = value
         if not root:
             root = node
         if stack:
@@ -20,24 +25,187 @@ def build_tree(gen):
                 stack.pop()
         if children:
             stack.append({'node':node, 'children':children})
-        elif ':' in node.label:
-            sym, val = node.label.split(':', 1)
-            node.label = sym
-            node.value = val
     return root
 
+LINE = re.compile(r'^([0-9]+):(.*)$', re.M)
+BAD_LINE = re.compile(r'^(?![0-9]+:).+$', re.M)
+
+def decode_flat(text, symbols=None, trusted=False):
+    '''Decodes the pre-order text format (see stat.py) of a whole buffer
+    straight into a FlatTree. Rather than going line by line the buffer is
+    split with one regex pass and the columns are converted and interned in
+    bulk, only the parent/size bookkeeping is done per node. Nodes after the
+    root's subtree is complete are ignored, just as they are unreachable from
+    the root returned by build_tree.
+    @params text : a string holding the pre-order enumeration of a tree
+    @params symbols : the Symbols table to intern labels in
+    @params trusted : skip checking every non blank line is "children:label"
+                      (malformed lines are then silently dropped)
+    @returns <FlatNode> as the root of the tree.
+    '''
+    if symbols is None: symbols = SYMBOLS
+    if not trusted:
+        bad = BAD_LINE.search(text)
+        if bad is not None:
+            if ':' not in bad.group(0):
+                raise SyntaxError, 'Expected colon, none found.'
+            raise SyntaxError, (
+              'Expected the format to be children:label. Where children is '
+              'an int.'
+            )
+    tree = FlatTree(symbols)
+    lines = LINE.findall(text)
+    if not lines: return tree.root()
+    heads, syms = zip(*lines)
+    kids = array('i', map(int, heads))
+    n = len(kids)
+
+    stack = [0] if kids[0] else list()
+    need = [kids[0]] if kids[0] else list()
+    parents = array('i', [-1]) * n
+    sizes = array('i', [1]) * n
+    end = n
+    push, pop = stack.append, stack.pop
+    for i in xrange(1, n):
+        if not stack:
+            end = i
+            break
+        parents[i] = stack[-1]
+        need[-1] -= 1
+        k = kids[i]
+        if k:
+            push(i)
+            need.append(k)
+            continue
+        while stack and need[-1] <= 0:
+            j = pop()
+            need.pop()
+            sizes[j] = i + 1 - j
+    for j in stack:
+        sizes[j] = end - j
+    if end < n:
+        syms = syms[:end]
+        del kids[end:], parents[end:], sizes[end:]
+
+    intern = symbols.intern
+    values = array('i', [-1]) * end
+    syms = list(syms)
+    for i in [i for i, sym in enumerate(syms) if ':' in sym and not kids[i]]:
+        syms[i], value = syms[i].split(':', 1)
+        values[i] = intern(value)
+    for sym in set(syms).difference(symbols.ids):
+        intern(sym)
+    tree.labels = array('i', map(symbols.ids.__getitem__, syms))
+    tree.values = values
+    tree.kids = kids
+    tree.parents = parents
+    tree.sizes = sizes
+    tree.digest = tree.hash()
+    return tree.root()
+
+class Symbols(object):
+    '''Interns labels (and leaf values) as small integers. SYMBOLS is the
+    corpus wide table: every tree built by build_tree or decode_flat interns
+    its labels there, so the artifacts can key their counts by `node.sym` and
+    only turn the ids back into labels when they produce their tables.
+    '''
+
+    def __init__(self):
+        self.ids = dict()
+        self.labels = list()
+
+    def intern(self, label):
+        i = self.ids.get(label)
+        if i is None:
+            i = self.ids[label] = len(self.labels)
+            self.labels.append(label)
+        return i
+
+    def __getitem__(self, i):
+        return self.labels[i]
+
+    def __len__(self):
+        return len(self.labels)
+
+SYMBOLS = Symbols()
+
+class FlatTree(object):
+    '''A tree stored as parallel pre-order arrays rather than as Node objects.
+    Node i has label symbols[labels[i]], leaf value symbols[values[i]] (or -1
+    for no value), kids[i] children, its parent at parents[i] (-1 for the
+    root) and its subtree spans indices i to i + sizes[i] - 1. Its first child
+    is at i + 1 and each next sibling at j + sizes[j].
+
+    The digest of the tree, its structural hash (see hash), is computed as the
+    tree is built.
+    '''
+
+    __slots__ = (
+        'symbols', 'labels', 'values', 'kids', 'parents', 'sizes', 'digest')
+
+    def __init__(self, symbols):
+        self.symbols = symbols
+        self.labels = array('i')
+        self.values = array('i')
+        self.kids = array('i')
+        self.parents = array('i')
+        self.sizes = array('i')
+        self.digest = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def root(self):
+        return FlatNode(self, 0)
+
+    def children(self, i):
+        '''The indices of the children of node i.'''
+        sizes = self.sizes
+        j = i + 1
+        for _ in xrange(self.kids[i]):
+            yield j
+            j += sizes[j]
+
+    def hash(self, i=0):
+        '''The structural hash of the subtree rooted at node i. The labels,
+        values and child counts of a subtree in pre-order determine its shape,
+        so identical subtrees (anywhere, in any tree sharing the symbol table)
+        have the same hash. The hash is of the subtree's slices of the arrays,
+        so it is as if each node hashed its label with its children's hashes.
+        '''
+        j = i + self.sizes[i]
+        h = hashlib.sha1(self.labels[i:j].tostring())
+        h.update(self.values[i:j].tostring())
+        h.update(self.kids[i:j].tostring())
+        return h.digest()
+
 class Node(object):
 
+    __slots__ = ('_label', 'sym', 'value', 'children')
+
     def __init__(self, label, children=None):
         self.label = label
         self.value = None
         self.children = children if children is not None else list()
 
+    @property
+    def label(self):
+        return self._label
+
+    @label.setter
+    def label(self, label):
+        self._label = label
+        self.sym = SYMBOLS.intern(label)
+
     def addkid(self, node, before=False):
         if before:  self.children.insert(0, node)
         else:   self.children.append(node)
         return self
 
+    def release(self):
+        '''Drops anything cached for the children (see FlatNode).'''
+        pass
+
     def get(self, label):
         if self.label == label: return self
         for c in self.children:
@@ -70,13 +238,30 @@ class Node(object):
     def __repr__(self):
         return super(Node, self).__repr__()[:-1] + " %s>" % str(self.label)
 
+    def digest(self):
+        '''The structural hash of the subtree rooted at this node: equal for
+        subtrees with the same labels, values and shape. FlatNodes hash their
+        tree's arrays instead (see FlatTree.hash), so only digests of the same
+        kind of node can be compared.'''
+        h = hashlib.sha1()
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            h.update('%d:%s:%s\n' % (len(n.children), n.label, n.value))
+            stack.extend(reversed(n.children))
+        return h.digest()
+
     def __str__(self):
-        def string(s):
-            if isinstance(s, Node): return str(s)
-            return '0:%s' % str(s)
-        s = "%d:%s" % (len(self.children), str(self.label))
-        s = '\n'.join([s]+[string(c) for c in self.children])
-        return s
+        lines = list()
+        stack = [self]
+        while stack:
+            n = stack.pop()
+            if not isinstance(n, Node):
+                lines.append('0:%s' % str(n))
+                continue
+            lines.append("%d:%s" % (len(n.children), str(n.label)))
+            stack.extend(reversed(n.children))
+        return '\n'.join(lines)
 
     def dotty(self):
         def string(s):
@@ -110,3 +295,165 @@ class Node(object):
         return 'digraph G {\n' + '\n'.join(nodes) + '\n' + '\n'.join(edges) + '\n}\n'
 
 
+
+
+class FlatNode(Node):
+    '''A read only Node view of one node of a FlatTree, so anything written
+    against Node works unchanged on the compact representation. The views of
+    the children are made when they are first asked for and kept until
+    release, which walktree calls as it leaves each node, so a walk only
+    holds the views of the nodes on its stack.'''
+
+    __slots__ = ('tree', 'index', '_children')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+        self._children = None
+
+    @property
+    def label(self):
+        return self.tree.symbols[self.tree.labels[self.index]]
+
+    @property
+    def sym(self):
+        return self.tree.labels[self.index]
+
+    @property
+    def value(self):
+        value = self.tree.values[self.index]
+        if value < 0: return None
+        return self.tree.symbols[value]
+
+    @property
+    def children(self):
+        if self._children is None:
+            tree = self.tree
+            self._children = [
+                FlatNode(tree, j) for j in tree.children(self.index)
+            ]
+        return self._children
+
+    def release(self):
+        self._children = None
+
+    def addkid(self, node, before=False):
+        raise TypeError, "FlatNode is read only"
+
+    def digest(self):
+        if self.index == 0 and self.tree.digest is not None:
+            return self.tree.digest
+        return self.tree.hash(self.index)
+
+    def __repr__(self):
+        return '<FlatNode %d %s>' % (self.index, str(self.label))
+
+class DAG(object):
+    '''The trees of a corpus hash-consed into one DAG: each distinct subtree
+    (same label, value and children) is stored once, as a node id, however
+    many times it occurs in however many trees. Node i has label
+    symbols[labels[i]], value symbols[values[i]] (or -1 for no value) and the
+    children ids kids[i]. Children always have smaller ids than their parents.
+    roots holds the root id of each tree added, in order, and copies[k] the
+    corpus positions of the k'th tree added (more than one when identical
+    trees are added once for all of their copies).
+    '''
+
+    def __init__(self, symbols=None):
+        if symbols is None: symbols = SYMBOLS
+        self.symbols = symbols
+        self.labels = array('i')
+        self.values = array('i')
+        self.kids = list()
+        self.roots = array('i')
+        self.copies = list()
+        self.ids = dict() # (label, value, kids) -> id
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, root, copies=None):
+        '''Adds the tree to the DAG, sharing the subtrees already in it.
+        @params root : the root of a tree (a Node or a FlatNode)
+        @params copies : the corpus positions of the tree [default: the next
+                         one]
+        @returns : the id of the root
+        '''
+        if isinstance(root, FlatNode) and root.index == 0:
+            tree = root.tree
+            nodes = zip(tree.labels, tree.values, tree.kids)
+        else:
+            intern = self.symbols.intern
+            nodes = list()
+            stack = [root]
+            while stack:
+                n = stack.pop()
+                value = -1 if n.value is None else intern(n.value)
+                nodes.append((n.sym, value, len(n.children)))
+                stack.extend(reversed(n.children))
+        ids = self.ids
+        stack = list()
+        for label, value, k in reversed(nodes):
+            kids = tuple(stack[-1:-k-1:-1]) if k else ()
+            if k: del stack[-k:]
+            key = (label, value, kids)
+            i = ids.get(key)
+            if i is None:
+                i = ids[key] = len(self.labels)
+                self.labels.append(label)
+                self.values.append(value)
+                self.kids.append(kids)
+            stack.append(i)
+        self.roots.append(stack[-1])
+        if copies is None: copies = (len(self.roots) - 1,)
+        self.copies.append(copies)
+        return stack[-1]
+
+    def node(self, i):
+        return DAGNode(self, i)
+
+    def occurrences(self):
+        '''The number of times each distinct subtree occurs in the trees,
+        propagated from the roots down to their children.'''
+        counts = [0]*len(self)
+        for i, copies in zip(self.roots, self.copies):
+            counts[i] += len(copies)
+        kids = self.kids
+        for i in xrange(len(self) - 1, -1, -1):
+            count = counts[i]
+            for j in kids[i]:
+                counts[j] += count
+        return counts
+
+class DAGNode(Node):
+    '''A read only Node view of one distinct subtree of a DAG.'''
+
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag, index):
+        self.dag = dag
+        self.index = index
+
+    @property
+    def label(self):
+        return self.dag.symbols[self.dag.labels[self.index]]
+
+    @property
+    def sym(self):
+        return self.dag.labels[self.index]
+
+    @property
+    def value(self):
+        value = self.dag.values[self.index]
+        if value < 0: return None
+        return self.dag.symbols[value]
+
+    @property
+    def children(self):
+        return [DAGNode(self.dag, j) for j in self.dag.kids[self.index]]
+
+    def addkid(self, node, before=False):
+        raise TypeError, "DAGNode is read only"
+
+    def __repr__(self):
+        return '<DAGNode %d %s>' % (self.index, str(self.label))
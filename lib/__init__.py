@@ -1 +1,8 @@
-from gram_parser import parse_grammar
\ No newline at end of file
+from gram_parser import parse_grammar
+from manifest import MANIFEST, load_manifest, save_manifest, diff_manifest
+from manifest import complete_manifest, text_entry
+from columnar import save_columns, load_columns
+from gram_index import GrammarIndex
+from heavy_hitters import HeavyHitters, merge_heavy_hitters
+from estimate import estimate
+from profiling import PROFILER
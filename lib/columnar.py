@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Binary columnar storage for tables. A table is stored as a directory
+holding one raw binary file of numpy values per column and a small "schema"
+file:
+
+    rows, <number of rows>
+    0, <type of column 0>, <numpy dtype of column 0>
+    1, <type of column 1>, <numpy dtype of column 1>
+    ...
+
+where the types are "int" (int64), "float" (float64), "bigint" (an integer
+too large for int64, stored as a string) and "str". The columns are memory
+mapped when the table is loaded and rows are only built as they are read.
+
+NB: the columns are not ".npy" files because reading their headers needs the
+standard library's ast module, which the top level ast.py hides.
+'''
+
+import os
+
+EXT = '.cols'
+SCHEMA = 'schema'
+
+INT64_MIN = -2**63
+INT64_MAX = 2**63 - 1
+
+def coltype(values):
+    '''The narrowest column type which can hold all of the values.'''
+    if all(isinstance(v, (int, long)) and not isinstance(v, bool)
+      for v in values):
+        if all(INT64_MIN <= v <= INT64_MAX for v in values): return 'int'
+        return 'bigint'
+    if all(isinstance(v, (int, long, float)) and not isinstance(v, bool)
+      for v in values):
+        return 'float'
+    return 'str'
+
+def save_columns(path, table):
+    '''Saves the table as a column directory at path. Ragged tables can't be
+    stored as columns.
+    @param path : the directory to create (or overwrite)
+    @param table : a sequence of rows of the same length
+    @returns : the table
+    '''
+    import numpy as np
+    rows = list(table)
+    width = len(rows[0]) if rows else 0
+    if any(len(row) != width for row in rows):
+        raise ValueError, 'Cannot store a ragged table as columns.'
+    if not os.path.isdir(path):
+        os.mkdir(path)
+    columns = zip(*rows) if rows else list()
+    types = [coltype(col) for col in columns]
+    for i, (col, type) in enumerate(zip(columns, types)):
+        if type == 'int': array = np.array(col, dtype=np.int64)
+        elif type == 'float': array = np.array(col, dtype=np.float64)
+        else: array = np.array([str(v) for v in col], dtype=np.string_)
+        array.tofile(os.path.join(path, '%d.bin' % i))
+        types[i] = (type, array.dtype.str)
+    f = open(os.path.join(path, SCHEMA), 'w')
+    f.write('rows, %d\n' % len(rows))
+    for i, (type, dtype) in enumerate(types):
+        f.write('%d, %s, %s\n' % (i, type, dtype))
+    f.close()
+    return table
+
+def load_columns(path):
+    '''Opens the column directory at path.
+    @returns : a ColumnTable
+    '''
+    f = open(os.path.join(path, SCHEMA), 'r')
+    s = f.read()
+    f.close()
+    rows = s.split('\n')
+    length = int(rows[0].split(',')[1])
+    schema = [
+        tuple(col.strip() for col in row.split(',')[1:])
+        for row in rows[1:] if row
+    ]
+    return ColumnTable(
+        path, length, [type for type, dtype in schema],
+        [dtype for type, dtype in schema])
+
+class ColumnTable(object):
+    '''A read only sequence of the rows of a column directory. Each column is
+    memory mapped the first time it is needed and rows are built, as tuples of
+    python values, a block at a time as they are read.
+    '''
+
+    BLOCK = 1 << 16
+
+    def __init__(self, path, length, types, dtypes):
+        self.path = path
+        self.length = length
+        self.types = types
+        self.dtypes = dtypes
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            import numpy as np
+            if not self.length:
+                self._columns = [np.array([], dtype=d) for d in self.dtypes]
+            else:
+                self._columns = [
+                    np.memmap(
+                        os.path.join(self.path, '%d.bin' % i), dtype=dtype,
+                        mode='r', shape=(self.length,))
+                    for i, dtype in enumerate(self.dtypes)
+                ]
+        return self._columns
+
+    def _row(self, values):
+        return tuple(
+            int(v) if type == 'bigint' else v
+            for v, type in zip(values, self.types)
+        )
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0: i += self.length
+        if not 0 <= i < self.length: raise IndexError, i
+        return self._row([col[i].item() for col in self.columns])
+
+    def __iter__(self):
+        columns = self.columns
+        bigints = [i for i, type in enumerate(self.types) if type == 'bigint']
+        for start in xrange(0, self.length, self.BLOCK):
+            block = [col[start:start+self.BLOCK].tolist() for col in columns]
+            for i in bigints:
+                block[i] = [int(v) for v in block[i]]
+            for row in zip(*block):
+                yield row
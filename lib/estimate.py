@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Probability estimates from counts of outcomes in groups (eg. productions
+grouped by their nonterminal, or rules grouped by context and nonterminal).
+The counts are numpy arrays with a parallel array of group ids and every
+group total is found with one grouped sum (numpy.bincount).
+
+Smoothing is given as None (the maximum likelihood estimate), ('add', k)
+(add-k: every possible outcome of a group is counted k more times) or
+('backoff', None) (Witten-Bell: a group's estimate is mixed with a prior, a
+lower order estimate, in proportion to the number of distinct outcomes seen
+in the group).
+'''
+
+def grouped_sums(groups, values, n):
+    '''The sum of the values of each of the n groups.'''
+    import numpy as np
+    return np.bincount(groups, weights=values, minlength=n)
+
+def estimate(groups, counts, smoothing=None, outcomes=None, prior=None):
+    '''The probability of each outcome within its group.
+    @params groups : numpy int array, the group of each outcome
+    @params counts : numpy float array, the count of each outcome
+    @params smoothing : None, ('add', k) or ('backoff', None)
+    @params outcomes : numpy array, the number of possible outcomes of each
+                       group (for add-k)
+    @params prior : numpy float array, the lower order probability of each
+                    outcome (for backoff)
+    @returns : numpy float array
+    '''
+    import numpy as np
+    n = int(groups.max()) + 1 if len(groups) else 0
+    totals = grouped_sums(groups, counts, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if smoothing is None:
+            return counts/totals[groups]
+        kind, k = smoothing
+        if kind == 'add':
+            return (counts + k)/(totals[groups] + k*outcomes[groups])
+        elif kind == 'backoff':
+            seen = np.bincount(groups, weights=(counts > 0), minlength=n)
+            seen = seen[groups]
+            return (counts + seen*prior)/(totals[groups] + seen)
+    raise ValueError, 'Unknown smoothing "%s"' % (kind,)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''A grammar compiled for fast production lookups. The productions are given
+dense ids 0..n-1 grouped by nonterminal, so the productions of a nonterminal
+are the ids in ranges[nonterm] = (start, stop), in the order they were given.
+'''
+
+class GrammarIndex(object):
+
+    def __init__(self, productions):
+        '''
+        @params productions : iterable of (nonterm, [production, ...]) where
+                              each production is a tuple of labels
+        '''
+        self.lhs = list()
+        self.rhs = list()
+        self.ids = dict()
+        self.ranges = dict()
+        for nonterm, P in productions:
+            start = len(self.rhs)
+            for p in P:
+                p = tuple(p)
+                self.ids[(nonterm, p)] = len(self.rhs)
+                self.lhs.append(nonterm)
+                self.rhs.append(p)
+            self.ranges[nonterm] = (start, len(self.rhs))
+
+    @staticmethod
+    def from_table(table):
+        '''Compiles the infer_grammar table, rows of (nonterm, 'a:b', ...).'''
+        return GrammarIndex(
+            (row[0], [tuple(p.split(':')) for p in row[1:]]) for row in table
+        )
+
+    @staticmethod
+    def from_grammar(grammar):
+        '''Compiles a grammar from lib.parse_grammar, ordering the productions
+        of each nonterminal by their ':' joined form.'''
+        return GrammarIndex(
+            (nonterm, sorted(P, key=lambda p: ':'.join(p)))
+            for nonterm, P in grammar.iteritems()
+        )
+
+    def __len__(self):
+        return len(self.rhs)
+
+    def number(self, nonterm, p):
+        '''The 1 based position of p among the productions of nonterm.'''
+        return self.ids[(nonterm, p)] - self.ranges[nonterm][0] + 1
+
+    def production(self, i):
+        '''The production with id i as the ':' joined string of the tables.'''
+        return ':'.join(self.rhs[i])
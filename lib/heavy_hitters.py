@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Approximate counts of the heaviest keys of a stream in bounded memory. This
+is the (weighted, mergeable) Misra-Gries summary: at most 2k counters are
+kept, and when there are more the (k+1)th largest count is subtracted from
+every counter and those left at zero or below are dropped. Each kept count
+is then at most `error` below the true count (and never above it), `error`
+is at most total/(k+1), and every key whose true count is above `error` is
+kept. Summaries of separate streams merge into a summary of both with the
+same guarantees.
+'''
+
+class HeavyHitters(object):
+
+    def __init__(self, k=None):
+        '''
+        @params k : the number of keys to report. None is only for empty
+                    summaries, which take the k of what is merged into them.
+        '''
+        self.k = k
+        self.counts = dict()
+        self.total = 0
+        self.error = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, key, count=1):
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + count
+        self.total += count
+        if len(counts) > 2*self.k: self.prune()
+
+    def prune(self):
+        '''Drops to at most k counters.'''
+        counts = self.counts
+        if len(counts) <= self.k: return
+        cut = sorted(counts.itervalues(), reverse=True)[self.k]
+        self.counts = dict(
+            (key, count - cut) for key, count in counts.iteritems()
+            if count > cut
+        )
+        self.error += cut
+
+    def merge(self, b):
+        '''Adds the summary b to this one.
+        @returns : self
+        '''
+        if self.k is None: self.k = b.k
+        counts = self.counts
+        for key, count in b.counts.iteritems():
+            counts[key] = counts.get(key, 0) + count
+        self.total += b.total
+        self.error += b.error
+        if self.k is not None and len(counts) > 2*self.k: self.prune()
+        return self
+
+    def map(self, f):
+        '''A copy of the summary with each key replaced by f(key).'''
+        summary = HeavyHitters(self.k)
+        summary.counts = dict(
+            (f(key), count) for key, count in self.counts.iteritems())
+        summary.total = self.total
+        summary.error = self.error
+        return summary
+
+    def top(self):
+        '''Prunes the summary to at most k keys and returns them as (key,
+        count) pairs, heaviest first. Each true count is between count and
+        count + error.'''
+        if self.k is not None: self.prune()
+        return sorted(
+            self.counts.iteritems(), key=lambda (key, count): (-count, key))
+
+def merge_heavy_hitters(a, b):
+    '''Merges the summaries in b into those in a (both map key -> summary).
+    @returns : a
+    '''
+    for key, summary in b.iteritems():
+        if key in a: a[key].merge(summary)
+        else: a[key] = summary
+    return a
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+import os, hashlib, collections
+
+MANIFEST = 'manifest.csv'
+TABLES = '# tables:'
+OPTIONS = '# options:'
+CHUNK = 1 << 20
+
+def file_entry(path):
+    '''Computes the manifest entry of the file at path, reading it CHUNK
+    bytes at a time.
+    @param path : the path to the file
+    @returns : (size, content hash)
+    '''
+    h = hashlib.sha1()
+    size = 0
+    f = open(path, 'rb')
+    while True:
+        chunk = f.read(CHUNK)
+        if not chunk: break
+        h.update(chunk)
+        size += len(chunk)
+    f.close()
+    return size, h.hexdigest()
+
+def text_entry(s):
+    '''The manifest entry of a file with the contents s (eg. from a read
+    done anyway), see file_entry.'''
+    return len(s), hashlib.sha1(s).hexdigest()
+
+def load_manifest(path):
+    '''Loads the manifest of the AST files which went into the tables of an
+    output directory. A missing manifest is an empty one.
+    @param path : the path to the manifest file
+    @returns : (ordered map path -> (size, content hash), in processing order,
+                the set of the tables which count exactly those files, or
+                None if the manifest is missing or does not name its tables,
+                map option -> value (as a string) the tables were made with)
+    '''
+    manifest = collections.OrderedDict()
+    tables = None
+    options = dict()
+    if not os.path.isfile(path): return manifest, tables, options
+    f = open(path, 'r')
+    s = f.read()
+    f.close()
+    for row in s.split('\n'):
+        if not row: continue
+        if row.startswith(TABLES):
+            tables = set(
+                name.strip() for name in row[len(TABLES):].split(',')
+                if name.strip()
+            )
+            continue
+        if row.startswith(OPTIONS):
+            options.update(
+                (option.strip() for option in item.split('=', 1))
+                for item in row[len(OPTIONS):].split(';') if '=' in item
+            )
+            continue
+        name, size, digest = (col.strip() for col in row.rsplit(',', 2))
+        manifest[name] = (int(size), digest)
+    return manifest, tables, options
+
+def save_manifest(path, manifest, tables, options):
+    '''Writes the manifest (as loaded by load_manifest) to path.
+    @param tables : the names of the tables made from the files
+    @param options : map option -> value (as a string) of the options which
+                     decide what the tables hold'''
+    f = open(path, 'w')
+    f.write('%s %s\n' % (TABLES, ', '.join(sorted(tables))))
+    f.write('%s %s\n' % (OPTIONS, '; '.join(
+        '%s=%s' % item for item in sorted(options.iteritems()))))
+    for name, (size, digest) in manifest.iteritems():
+        f.write('%s, %d, %s\n' % (name, size, digest))
+    f.close()
+
+def diff_manifest(manifest, paths):
+    '''Compares files against the manifest of a previous run. Only the files
+    in the manifest with the size of their entry are hashed, the entries of
+    the others are left as None to be filled in once they have been read (see
+    complete_manifest).
+    @param manifest : as loaded by load_manifest
+    @param paths : the paths of the files given for this run
+    @returns : (map path -> entry for the new files,
+                map path -> entry for the changed files)
+    '''
+    new = collections.OrderedDict()
+    changed = collections.OrderedDict()
+    for path in paths:
+        if path not in manifest:
+            new[path] = None
+            continue
+        size, digest = manifest[path]
+        if os.path.getsize(path) != size:
+            changed[path] = None
+            continue
+        entry = file_entry(path)
+        if entry[1] != digest:
+            changed[path] = entry
+    return new, changed
+
+def complete_manifest(manifest, entries):
+    '''Fills in the entries left as None by diff_manifest.
+    @param entries : map path -> entry of the files hashed as they were read
+    @returns : the manifest
+    '''
+    for path, entry in manifest.iteritems():
+        if entry is None:
+            manifest[path] = entries.get(path) or file_entry(path)
+    return manifest
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''The measurements behind --profile. A run is split into stages (the walk of
+the trees and the making of each artifact), each timed as a whole, and the
+frequent small operations (reading and parsing each tree) are summed into
+counters. The report is written as JSON:
+
+    {
+      "options": [[option, argument], ...],
+      "files": <the number of files given>,
+      "total": <stage>,
+      "stages": {"walk": <stage>, "symbol_count": <stage>, ...},
+      "counters": {"read_file_or_die": <counter>, "mktree": <counter>, ...}
+    }
+
+where a stage has its "wall" and "cpu" seconds, "peak_rss_delta_kb" (how much
+the peak resident set size of the process grew during it) and whatever it
+counted (eg. "trees", "nodes" or "rows"), and a counter has its "calls" and
+total "wall" and "cpu" seconds and amounts. Every amount also has a rate per
+wall second, eg. "nodes_per_sec". The cpu time and memory are those of the
+whole process, so with -j they include the stages running at the same time.
+'''
+
+import os, time, json, resource, contextlib, collections
+
+def usage():
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return time.time(), r.ru_utime + r.ru_stime, r.ru_maxrss
+
+def rates(record):
+    '''Adds the rate per wall second of each amount of the record.'''
+    wall = record['wall']
+    for key, amount in record.items():
+        if key in ('wall', 'cpu', 'calls', 'peak_rss_delta_kb'): continue
+        if key.endswith('_per_sec'): continue
+        record[key + '_per_sec'] = amount/wall if wall > 0 else None
+    return record
+
+class Profiler(object):
+
+    def __init__(self):
+        self.path = None
+        self.dumps = None
+        self.stages = collections.OrderedDict()
+        self.counters = dict()
+        self.started = None
+
+    def init(self, path, dumps=None):
+        '''Starts profiling the run.
+        @params path : where the report is written, None to not profile
+        @params dumps : a directory to write a cProfile dump of each stage to
+                        ("<stage>.prof"), or None
+        '''
+        self.path = path
+        self.dumps = dumps
+        if path is not None: self.started = usage()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def now(self):
+        '''The start of a call for count, None when not profiling.'''
+        if self.path is None: return None
+        r = resource.getrusage(resource.RUSAGE_SELF)
+        return time.time(), r.ru_utime + r.ru_stime
+
+    def count(self, name, start=None, **amounts):
+        '''Adds a call begun at start (from now) and its amounts to the named
+        counter. Does nothing when not profiling.'''
+        if self.path is None: return
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = dict(calls=0, wall=0.0, cpu=0.0)
+        counter['calls'] += 1
+        if start is not None:
+            wall, cpu = self.now()
+            counter['wall'] += wall - start[0]
+            counter['cpu'] += cpu - start[1]
+        for key, amount in amounts.iteritems():
+            counter[key] = counter.get(key, 0) + amount
+
+    def merge(self, counters):
+        '''Adds the counters of another process (eg. a -j worker).'''
+        for name, b in counters.iteritems():
+            a = self.counters.setdefault(name, dict())
+            for key, amount in b.iteritems():
+                a[key] = a.get(key, 0) + amount
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''Measures the with block as the named stage. The block is given the
+        stage's record to put its amounts into.'''
+        record = dict()
+        if self.path is None:
+            yield record
+            return
+        profile = None
+        if self.dumps is not None:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        wall, cpu, rss = usage()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(os.path.join(self.dumps, name + '.prof'))
+            end = usage()
+            record.update(
+                wall=end[0] - wall, cpu=end[1] - cpu,
+                peak_rss_delta_kb=end[2] - rss)
+            self.stages[name] = rates(record)
+
+    def report(self, options, files):
+        '''Writes the report, if profiling.
+        @params options : the (option, argument) pairs of the run
+        @params files : the number of files given
+        '''
+        if self.path is None: return
+        end = usage()
+        total = dict(
+            wall=end[0] - self.started[0], cpu=end[1] - self.started[1],
+            peak_rss_kb=end[2])
+        report = collections.OrderedDict((
+            ('options', options),
+            ('files', files),
+            ('total', total),
+            ('stages', self.stages),
+            ('counters', dict(
+                (name, rates(dict(counter)))
+                for name, counter in self.counters.iteritems()
+            )),
+        ))
+        f = open(self.path, 'w')
+        json.dump(report, f, indent=2)
+        f.write('\n')
+        f.close()
+
+PROFILER = Profiler()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Packed corpora. A pack is a single binary file holding many trees in the
+ast.FlatTree layout, so a corpus of thousands of small AST files can be opened
+once and any tree read without parsing the others. The layout (little
+endian) is
+
+    header  : magic "GRAMPACK", version (u32), number of trees (u32),
+              offset of the symbols (u64), offset of the index (u64)
+    trees   : for each tree, its number of nodes n (u32) followed by the int32
+              arrays labels[n], values[n], kids[n], parents[n], sizes[n]
+    symbols : the number of symbols (u32) then for each its length in bytes
+              (u32) and the bytes
+    index   : for each tree, the offset of the tree (u64)
+
+Label and value ids in the trees index the symbols of the pack. They are
+mapped to ids of ast.SYMBOLS when the pack is opened, which is free when the
+pack's symbols are the first ones interned.
+'''
+
+import sys, struct, mmap
+from array import array
+
+import ast
+
+EXT = '.pack'
+MAGIC = 'GRAMPACK'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+U32 = struct.Struct('<I')
+U64 = struct.Struct('<Q')
+ARRAYS = ('labels', 'values', 'kids', 'parents', 'sizes')
+
+assert array('i').itemsize == 4
+
+def ispack(path):
+    return path.endswith(EXT)
+
+def _tobytes(a):
+    if sys.byteorder != 'little':
+        a = array('i', a)
+        a.byteswap()
+    return a.tostring()
+
+def _fromstring(s):
+    a = array('i')
+    a.fromstring(s)
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+def write_pack(path, trees, symbols=None):
+    '''Writes the trees to a new pack at path. The trees are streamed to the
+    file, only their offsets are kept in memory.
+    @params path : where to write the pack
+    @params trees : iterable of ast.FlatNode roots (eg. from ast.decode_flat)
+    @params symbols : the ast.Symbols table the trees were built with
+    @returns : the number of trees written
+    '''
+    if symbols is None: symbols = ast.SYMBOLS
+    offsets = list()
+    f = open(path, 'wb')
+    f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+    for root in trees:
+        tree = root.tree
+        if tree.symbols is not symbols:
+            raise ValueError, 'All of the trees must share one symbol table.'
+        offsets.append(f.tell())
+        f.write(U32.pack(len(tree)))
+        for name in ARRAYS:
+            f.write(_tobytes(getattr(tree, name)))
+    symbols_offset = f.tell()
+    f.write(U32.pack(len(symbols)))
+    for label in symbols.labels:
+        f.write(U32.pack(len(label)))
+        f.write(label)
+    index_offset = f.tell()
+    for offset in offsets:
+        f.write(U64.pack(offset))
+    f.seek(0)
+    f.write(HEADER.pack(
+        MAGIC, VERSION, len(offsets), symbols_offset, index_offset))
+    f.close()
+    return len(offsets)
+
+class Pack(object):
+    '''A memory mapped pack. pack[i] builds the i'th tree (as an ast.FlatNode
+    root) straight from the mapped arrays, without touching the other trees.
+    '''
+
+    def __init__(self, path, symbols=None):
+        if symbols is None: symbols = ast.SYMBOLS
+        self.path = path
+        self.symbols = symbols
+        f = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, version, self.length, symbols_offset, self.index_offset = \
+            HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError, '"%s" is not a version %d pack.' % (path, VERSION)
+        self.remap = self._load_symbols(symbols_offset)
+
+    def _load_symbols(self, offset):
+        '''Interns the symbols of the pack.
+        @returns : None if the ids of the pack are ast.SYMBOLS ids already,
+                   else the list mapping pack ids to symbol ids.
+        '''
+        m = self.map
+        (count,) = U32.unpack_from(m, offset)
+        offset += U32.size
+        remap = list()
+        for i in xrange(count):
+            (size,) = U32.unpack_from(m, offset)
+            offset += U32.size
+            remap.append(self.symbols.intern(m[offset:offset+size]))
+            offset += size
+        if remap == range(count): return None
+        return remap
+
+    def close(self):
+        self.map.close()
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if i < 0: i += self.length
+        if not 0 <= i < self.length: raise IndexError, i
+        m = self.map
+        (offset,) = U64.unpack_from(m, self.index_offset + U64.size*i)
+        (n,) = U32.unpack_from(m, offset)
+        offset += U32.size
+        tree = ast.FlatTree(self.symbols)
+        for name in ARRAYS:
+            setattr(tree, name, _fromstring(m[offset:offset+4*n]))
+            offset += 4*n
+        remap = self.remap
+        if remap is not None:
+            tree.labels = array('i', (remap[l] for l in tree.labels))
+            tree.values = array(
+                'i', (remap[v] if v >= 0 else v for v in tree.values))
+        if n: tree.digest = tree.hash()
+        return tree.root()
+
+    def __iter__(self):
+        for i in xrange(self.length):
+            yield self[i]
+
+    def range(self, start, stop):
+        for i in xrange(start, stop):
+            yield self[i]
@@ -7,7 +7,7 @@
 import os, sys
 from getopt import getopt, GetoptError
 
-import ast, artifacts, lib
+import ast, artifacts, lib, pack
 
 VERSION = 'git master'
 
@@ -24,6 +24,15 @@ error_codes = {
     'stdin_and_files':10,
     'file_instead_of_dir':11,
     'stdin_and_coverage':12,
+    'bad_jobs':13,
+    'changed_files':14,
+    'bad_format':15,
+    'bad_pack':16,
+    'bad_ngrams':17,
+    'bad_top':18,
+    'bad_context':19,
+    'bad_smoothing':20,
+    'bad_bars':21,
 }
 
 usage_message = \
@@ -65,10 +74,10 @@ Explanation
 
       corresponds to
                               root
-                              /  \
-                             /    \
+                              /  \\
+                             /    \\
                     left side      right side
-                    /    \         /    |    \
+                    /    \         /    |    \\
                    x      y       a     b     c
                           |
                           z
@@ -110,6 +119,8 @@ Options
                                           [default: true]
     -t, tables=<bool>                   generate statistic tables (as csv files)
                                           [default: true]
+    -f, format=<format>                 how to store the statistic tables.
+                                          [default: csv]
     -a, artifacts                       list what artifacts `stat.py` can
                                           generate
     -A, artifact=<artspec>              generate a specific artifact only.
@@ -129,18 +140,149 @@ Options
                                           are updated. The new tables will only
                                           overwrite the old tables if
                                           "-o <dirname>" == "-T <dirname>"
+                                          The files already counted in the
+                                          tables (see Manifest below) are
+                                          skipped.
     -s, stdin                           accept ASTs on standard in. With blank
                                           lines seperating trees. If files are
                                           supplied with this flag it will be an
                                           error. Unfortunately you cannot
                                           provide coverage information in this
                                           mode.
+    -j, jobs=<int>                      how much to do at once: the files are
+                                          walked by <int> worker processes
+                                          (each computing partial tables which
+                                          are then merged), up to <int>
+                                          artifacts are made at once (each as
+                                          soon as those it depends on are
+                                          made) and ast_imgs runs up to <int>
+                                          dot processes at once. Without -j
+                                          the walk and the artifacts are done
+                                          one at a time and ast_imgs runs one
+                                          dot process per cpu.
+    --trusted                           skip validating each line of the ASTs.
+                                          Faster, but malformed lines are
+                                          dropped instead of reported.
+    --exact-treenums                    also compute the exact tree numbers,
+                                          not just their log10. (They can be
+                                          very large.)
+    --dedup                             walk each distinct tree once, weighting
+                                          the counts by its number of copies.
+                                          The per tree tables then list the
+                                          copies of a tree together, after
+                                          its first copy.
+    --dag                               share identical subtrees across the
+                                          corpus in one DAG and count each
+                                          distinct subtree once, weighted by
+                                          its occurrences, where the artifact
+                                          allows it.
+    -n, ngrams=<orders>                 also count the vertical n-grams of
+                                          these lengths (see ngram_counts).
+                                          3-grams are always counted.
+    -k, context=<int>                   count the rules chosen after each
+                                          context of up to <int> previous
+                                          nonterminals (every order from 0 to
+                                          <int> is counted in the one pass)
+                                          [default: 2]
+    --smoothing=<smoothing>             how to estimate production_probability
+                                          and conditional_probabilities.
+                                          [default: none]
+    --top=<int>                         only track the <int> heaviest n-grams
+                                          (of each length) and conditional
+                                          counts, in memory bounded by <int>,
+                                          see Top below. This replaces
+                                          ngram_counts, corpus_ngram_counts,
+                                          prod_3grams, conditional_counts,
+                                          conditional_context_counts and
+                                          conditional_probabilities with
+                                          top_ngram_counts and
+                                          top_conditional_counts.
+    --bars=<int>                        draw at most <int> bars in each
+                                          histogram: the heaviest <int>-1
+                                          and one "other" bar for the rest.
+                                          [default: 40]
+    --profile=<file>                    write a report of where the time and
+                                          memory of the run went to <file>,
+                                          see Profile below.
+    --cprofile=<directory>              with --profile, also write a
+                                          cProfile dump of each stage to
+                                          <directory>/<stage>.prof
+    -p, pack=<file>                     write every input tree into the pack
+                                          <file> (see Packs below) instead of
+                                          generating artifacts.
+
+Packs
+
+    A pack is a single binary file holding many parse trees in the compact
+    array form used internally, with an index of where each tree starts.
+    Files given as FILE whose name ends in ".pack" are read as packs, e.g.
+
+        ./stat.py -p corpus.pack `find test/ex -name '*.ast'`
+        ./stat.py -j 4 corpus.pack
+
+    Packs are memory mapped so each tree is read directly from the file
+    without parsing, and with -j the workers are given ranges of trees
+    within the pack.
+
+Top
+
+    With --top=k at most 2k counters are kept for each n-gram length and each
+    context order. Whenever there are more, the (k+1)th largest count is
+    taken off every counter and the counters left empty are dropped (the
+    Misra-Gries summary). The tables report each count together with the
+    error of its length or order: the true count is at least the count and
+    at most the count plus the error, the error is at most 1/(k+1) of the
+    total count of that length or order, and anything whose count exceeds
+    the error is in the table.
+
+Profile
+
+    The --profile report is a JSON object with the time and memory of the
+    whole run ("total"), of each of its stages ("stages": "walk", the single
+    pass over the trees, and then each artifact made) and of the reading and
+    parsing of the trees ("counters": "read_file_or_die" and "mktree", summed
+    over their calls). Each has its wall and cpu seconds, the stages how much
+    the peak memory (RSS) of the process grew while they ran, and each what
+    it counted (trees, nodes, bytes, rows) together with the rate per second.
+
+Manifest
+
+    The output directory gets a "manifest.csv" naming the tables made by the
+    run and the options deciding what they hold (-k, -n, --exact-treenums
+    and --top) on its first lines, then listing every AST file counted in
+    them as
+
+        path, size, sha1 of the contents
+
+    With -T, files listed in the manifest of the -T directory with the same
+    contents are not parsed or counted again, so re-running over a growing
+    corpus only processes the new files. If a file has changed since it was
+    counted, a table is to be made which the manifest does not name, or one
+    of those options differs, the tables are recomputed from scratch, which
+    requires every file in the manifest to be given again. Tables without a
+    manifest naming them (eg. made before manifests were written) are taken
+    to count none of the files given, which are all counted into them.
 
 Specs
 
     <file>                              the path to a file
     <directory>                         the path to a directory.
     <bool>                              either "true" or "false"
+    <int>                               a positive integer
+    <orders>                            comma separated positive integers,
+                                          e.g. "2,4"
+    <smoothing>                         "none" (the relative counts), "add-<k>"
+                                          (count every rule <k> more times,
+                                          eg. "add-1" or "add-0.5") or
+                                          "backoff" (Witten-Bell, mixing in
+                                          the estimate of the next shorter
+                                          context)
+    <format>                            either "csv" or "cols". "cols" stores
+                                          each table as a directory
+                                          "<table>.cols" of binary numpy
+                                          columns, which are memory mapped
+                                          when the table is loaded by -T.
+                                          (requires numpy)
     <artspec>                           <artifact>:<file>
                                         or <artifact> (default loc will be used)
     <artifact>                          an artifact in the list generated by
@@ -166,24 +308,18 @@ def usage(code=None):
         code = error_codes['usage']
     sys.exit(code)
 
-def mktree(s):
+def mktree(s, trusted=False):
     '''Makes a tree from the pre-order enumeration. See the usage for the grammar.
     @params s : string in pre-order enumeration
-    @returns <ast.Node> as the root of the tree.
+    @params trusted : skip validating each line (see ast.decode_flat)
+    @returns <ast.FlatNode> as the root of the tree. The tree is stored in the
+             compact array backed ast.FlatTree, the root is a Node compatible
+             view onto it.
     '''
-    def g(s):
-        for line in s.split('\n'):
-            if not line: continue
-            if ':' not in line:
-                raise SyntaxError, 'Expected colon, none found.'
-            children, sym = line.split(':', 1)
-            if not children.isdigit():
-                raise SyntaxError, (
-                  'Expected the format to be children:label. Where children is '
-                  'an int.'
-                )
-            yield int(children), sym
-    return ast.build_tree(g(s))
+    start = lib.PROFILER.now()
+    tree = ast.decode_flat(s, trusted=trusted)
+    lib.PROFILER.count('mktree', start, trees=1, nodes=len(tree.tree))
+    return tree
 
 def assert_file_exists(path):
     '''checks if the file exists. If it doesn't causes the program to exit.
@@ -213,6 +349,7 @@ def read_file_or_die(path):
     @param path : the path to the file
     @returns string : the contents of the file
     '''
+    start = lib.PROFILER.now()
     try:
         f = open(path, 'r')
         s = f.read()
@@ -220,12 +357,15 @@ def read_file_or_die(path):
     except Exception:
         log('Error reading file at "%s".' % path)
         usage(error_codes['bad_file_read'])
+    lib.PROFILER.count('read_file_or_die', start, bytes=len(s))
     return s
 
 def split_stdin():
-    '''Read the stdin a yield chunks seperated by the blank lines'''
+    '''Read the stdin a yield chunks seperated by the blank lines. The stdin is
+    read incrementally so only one chunk is held in memory at a time.'''
     lines = list()
-    for line in sys.stdin.read().split('\n'):
+    for line in sys.stdin:
+        line = line.rstrip('\n')
         if not line and lines:
             yield '\n'.join(lines)
             lines = list()
@@ -234,6 +374,123 @@ def split_stdin():
     if lines:
         yield '\n'.join(lines)
 
+def open_pack_or_die(path):
+    '''Opens the pack at path, if it isn't one it kills the program.
+    @param path : the path to the pack
+    @returns pack.Pack
+    '''
+    try:
+        return pack.Pack(path)
+    except Exception, e:
+        log('Error opening pack at "%s". %s' % (path, e))
+        usage(error_codes['bad_pack'])
+
+class Corpus(object):
+    '''The syntax trees to characterize. Trees are parsed lazily as the corpus
+    is iterated and are dropped as soon as the consumer moves on, so the whole
+    corpus is never held in memory at once. Iterating again re-reads and
+    re-parses the files. The trees on stdin can only be read once, unless
+    `retain` is set before the first iteration in which case their text is
+    kept for later iterations (see artifacts.engine.produce).
+
+    Files ending in pack.EXT are packs (see pack.py), their trees are read
+    from the pack in order. Each of `sources` is either the path of an AST
+    file or (path, start, stop) for trees start to stop-1 of a pack.
+    '''
+
+    def __init__(self, file_paths, stdin=False, sources=None, trusted=False):
+        if sources is None:
+            sources = [self.source(path) for path in file_paths]
+        self.sources = sources
+        self.stdin = stdin
+        self.trusted = trusted
+        self.retain = False
+        self.chunks = None
+        self.stdin_count = None
+        self.entries = dict() # path -> manifest entry, of the files read
+
+    @staticmethod
+    def source(path):
+        if not pack.ispack(path): return path
+        p = open_pack_or_die(path)
+        length = len(p)
+        p.close()
+        return (path, 0, length)
+
+    @staticmethod
+    def count(source):
+        if isinstance(source, str): return 1
+        path, start, stop = source
+        return stop - start
+
+    def __len__(self):
+        length = sum(self.count(source) for source in self.sources)
+        if not self.stdin: return length
+        if self.stdin_count is None:
+            raise TypeError, 'The length of stdin is unknown until it is read.'
+        return length + self.stdin_count
+
+    def shards(self, n):
+        '''Splits the files and packs (but not stdin) into at most n contiguous
+        corpora of about the same number of trees. Packs are split by tree.'''
+        total = sum(self.count(source) for source in self.sources)
+        size = max(1, -(-total//n))
+        shards = list()
+        current = list()
+        room = size
+        for source in self.sources:
+            while source is not None:
+                if isinstance(source, str) or self.count(source) <= room:
+                    piece, source = source, None
+                else:
+                    path, start, stop = source
+                    piece = (path, start, start + room)
+                    source = (path, start + room, stop)
+                current.append(piece)
+                room -= self.count(piece)
+                if room <= 0:
+                    shards.append(Corpus(None, sources=current, trusted=self.trusted))
+                    current, room = list(), size
+        if current:
+            shards.append(Corpus(None, sources=current, trusted=self.trusted))
+        return shards
+
+    def stdin_texts(self):
+        if not self.stdin: return
+        if self.chunks is not None:
+            for chunk in self.chunks:
+                yield chunk
+            return
+        if self.stdin_count is not None:
+            raise Exception, 'The trees on stdin have already been consumed.'
+        chunks = list() if self.retain else None
+        count = 0
+        for chunk in split_stdin():
+            count += 1
+            if chunks is not None: chunks.append(chunk)
+            yield chunk
+        self.chunks = chunks
+        self.stdin_count = count
+
+    def __iter__(self):
+        for source in self.sources:
+            if isinstance(source, str):
+                s = read_file_or_die(source)
+                self.entries[source] = lib.text_entry(s)
+                yield mktree(s, self.trusted)
+                continue
+            path, start, stop = source
+            p = open_pack_or_die(path)
+            for tree in p.range(start, stop):
+                yield tree
+            p.close()
+        for tree in self.stdin_trees():
+            yield tree
+
+    def stdin_trees(self):
+        for s in self.stdin_texts():
+            yield mktree(s, self.trusted)
+
 def parse_bool(s):
     '''parses s to check it is in [true, false]. returns the appropriate
     bool. If it isn't a book prints error and exits.
@@ -247,6 +504,71 @@ def parse_bool(s):
         usage(error_codes['bad_bool'])
     return bools[s]
 
+def parse_positive(s, code):
+    '''parses s as a positive integer (eg. the number of jobs of -j). If it
+    isn't one prints error and exits.
+    @param s : a string
+    @param code : the name of the error code to exit with
+    @returns int
+    '''
+    if not s.isdigit() or int(s) < 1:
+        log('Expected a positive integer found "%s"' % (s))
+        usage(error_codes[code])
+    return int(s)
+
+def parse_orders(s):
+    '''parses s as a comma separated list of n-gram lengths. If it isn't one
+    prints error and exits.
+    @param s : a string
+    @returns [int]
+    '''
+    orders = [order.strip() for order in s.split(',')]
+    if not all(order.isdigit() and int(order) > 0 for order in orders):
+        log('Expected positive integers seperated by commas found "%s"' % (s))
+        usage(error_codes['bad_ngrams'])
+    return [int(order) for order in orders]
+
+def parse_context(s):
+    '''parses s as the longest context of the conditional counts (a number
+    of nonterminals, possibly 0). If it isn't one prints error and exits.
+    @param s : a string
+    @returns int
+    '''
+    if not s.isdigit():
+        log('Expected a non-negative integer found "%s"' % (s))
+        usage(error_codes['bad_context'])
+    return int(s)
+
+def parse_smoothing(s):
+    '''parses s as a smoothing (see lib.estimate). If it isn't one prints
+    error and exits.
+    @param s : a string
+    @returns None, ('add', k) or ('backoff', None)
+    '''
+    if s == 'none': return None
+    if s == 'backoff': return ('backoff', None)
+    if s.startswith('add-'):
+        try:
+            k = float(s[len('add-'):])
+        except ValueError:
+            k = -1
+        if k >= 0: return ('add', k)
+    log('Expected "none", "add-<k>" or "backoff" found "%s"' % (s))
+    usage(error_codes['bad_smoothing'])
+
+def parse_format(s):
+    '''parses s to check it is a table format. If it isn't prints error and
+    exits.
+    @param s : a string
+    @returns str
+    '''
+    formats = ('csv', 'cols')
+    if s not in formats:
+        log('Expected a table format found "%s"' % (s))
+        log('The formats are %s' % str(formats))
+        usage(error_codes['bad_format'])
+    return s
+
 def show_artifacts(conf):
     '''Print the available artifacts and exit normally.'''
     for name, d in artifacts.engine.filter_artifacts(conf, artifacts.available_artifacts(conf)):
@@ -304,16 +626,81 @@ def load_coverage(coverage, file_paths):
         for path, table in tables
     ]
 
+def select_files(file_paths, usetables, loadpath, tables, options):
+    '''Picks the files to process using the manifest of the tables being
+    loaded (if any). If a file changed since it was counted, one of the
+    tables to be made is not one the manifest was written for, or the tables
+    were made with other options, the old tables can't be used, so everything
+    is processed again without them. Tables
+    without a manifest (from before they were written) are trusted to count
+    none of the files given.
+    @param file_paths : the files given on the command line
+    @param usetables : is -T in use
+    @param loadpath : the -T directory
+    @param tables : the names of the tables to be made
+    @param options : the options deciding what the tables hold (see
+                     artifacts.table_options)
+    @returns : (files to process, the manifest to save, usetables)
+    '''
+    if not usetables:
+        new, changed = lib.diff_manifest(dict(), file_paths)
+        return file_paths, new, usetables
+    manifest, counted, made_with = lib.load_manifest(
+        os.path.join(loadpath, lib.MANIFEST))
+    if counted is None:
+        log('WARNING: "%s" has no manifest naming its tables, every file '
+            'given is counted into them.' % loadpath)
+        counted, made_with = tables, options
+    new, changed = lib.diff_manifest(manifest, file_paths)
+    uncounted = [name for name in tables if name not in counted]
+    differ = [
+        name for name in sorted(options)
+        if made_with.get(name) != options[name]
+    ]
+    if not changed and not uncounted and not differ:
+        manifest.update(new)
+        return list(new), manifest, usetables
+    missing = set(manifest) - set(file_paths)
+    if missing:
+        if changed:
+            log('These files changed since they were counted in "%s":' % (
+                loadpath))
+            for path in changed: log('    ' + path)
+        if uncounted:
+            log('These tables are not in the manifest of "%s":' % loadpath)
+            for name in uncounted: log('    ' + name)
+        if differ:
+            log('The tables of "%s" were made with other options:' % loadpath)
+            for name in differ:
+                log('    %s: %s, now %s' % (
+                    name, made_with.get(name), options[name]))
+        log('Recomputing the tables requires all of the files they count, '
+            '%d were not given, eg.' % len(missing))
+        for path in sorted(missing)[:10]: log('    ' + path)
+        usage(error_codes['changed_files'])
+    if changed:
+        log('WARNING: files changed since they were counted, recomputing the '
+            'tables from scratch.')
+    elif uncounted:
+        log('WARNING: the manifest does not cover every table, recomputing '
+            'the tables from scratch.')
+    else:
+        log('WARNING: the tables were made with other options, recomputing '
+            'them from scratch.')
+    return select_files(file_paths, False, loadpath, tables, options)
+
 def main(args):
 
     try:
         opts, args = getopt(
             args,
-            'hvg:o:i:t:aA:T:sE:c',
+            'hvg:o:i:t:aA:T:sE:cj:f:n:k:p:',
             [
               'help', 'version', 'grammar=', 'outdir=', 'imgs=', 'tables=',
               'artifacts', 'artifact=', 'usetables=', 'stdin', 'exclude',
-              'coverage',
+              'coverage', 'jobs=', 'format=', 'ngrams=', 'context=', 'pack=',
+              'trusted', 'exact-treenums', 'dedup', 'dag', 'top=',
+              'smoothing=', 'bars=', 'profile=', 'cprofile=',
             ]
         )
     except GetoptError, err:
@@ -331,6 +718,20 @@ def main(args):
     excluded = list()
     list_artifacts = False
     coverage = None
+    jobs = None
+    format = 'csv'
+    packpath = None
+    trusted = False
+    exact_treenums = False
+    dedup = False
+    dag = False
+    ngrams = list()
+    top = None
+    context = 2
+    smoothing = None
+    bars = 40
+    profile = None
+    cprofile = None
     for opt, arg in opts:
         if opt in ('-h', '--help'):
             usage()
@@ -362,6 +763,34 @@ def main(args):
             usetables = True
         elif opt in ('-s', '--stdin'):
             stdin = True
+        elif opt in ('-j', '--jobs'):
+            jobs = parse_positive(arg, 'bad_jobs')
+        elif opt in ('-f', '--format'):
+            format = parse_format(arg)
+        elif opt in ('-n', '--ngrams'):
+            ngrams = parse_orders(arg)
+        elif opt in ('-k', '--context'):
+            context = parse_context(arg)
+        elif opt == '--smoothing':
+            smoothing = parse_smoothing(arg)
+        elif opt == '--top':
+            top = parse_positive(arg, 'bad_top')
+        elif opt == '--bars':
+            bars = parse_positive(arg, 'bad_bars')
+        elif opt == '--profile':
+            profile = os.path.abspath(arg)
+        elif opt == '--cprofile':
+            cprofile = assert_dir_exists(arg)
+        elif opt in ('-p', '--pack'):
+            packpath = arg
+        elif opt == '--trusted':
+            trusted = True
+        elif opt == '--exact-treenums':
+            exact_treenums = True
+        elif opt == '--dedup':
+            dedup = True
+        elif opt == '--dag':
+            dag = True
 
     if coverage is not None and stdin:
         log('Cannot process both coverage and stdin, supply one or the other.')
@@ -375,10 +804,12 @@ def main(args):
         log('You must provide a list of syntax trees to characterize.')
         usage(error_codes['no_args'])
 
-    file_paths = sorted(assert_file_exists(arg) for arg in args)
-    syntax_trees = [mktree(read_file_or_die(path)) for path in file_paths]
-    if stdin: syntax_trees += [mktree(tree) for tree in split_stdin()]
-    coverage = load_coverage(coverage, file_paths)
+    lib.PROFILER.init(profile, cprofile)
+    file_paths = sorted(set(assert_file_exists(arg) for arg in args))
+    if packpath is not None:
+        count = pack.write_pack(packpath, Corpus(file_paths, stdin, trusted=trusted))
+        log('packed %d trees into %s' % (count, packpath))
+        return
 
     if requested_artifacts:
         genimgs = False
@@ -388,7 +819,7 @@ def main(args):
         grammar = lib.parse_grammar(read_file_or_die(grammar))
 
 
-    conf = {'trees':syntax_trees,
+    conf = {'trees':None,
             'grammar': grammar,
             'outdir':assert_dir_exists(outdir),
             'loadtables':usetables,
@@ -399,12 +830,34 @@ def main(args):
             'excluded_artifacts':excluded,
             'coverage':coverage,
             'list_artifacts':list_artifacts,
+            'jobs':jobs,
+            'format':format,
+            'exact_treenums':exact_treenums,
+            'dedup':dedup,
+            'dag':dag,
+            'ngrams':ngrams,
+            'top':top,
+            'context':context,
+            'smoothing':smoothing,
+            'bars':bars,
     }
 
     if list_artifacts:
         show_artifacts(conf)
-    else:
-        artifacts.produce(conf)
+
+    tables = artifacts.scheduled_tables(conf)
+    options = artifacts.table_options(conf)
+    file_paths, manifest, usetables = select_files(
+        file_paths, usetables, loadpath, tables, options)
+    conf['loadtables'] = usetables
+    conf['trees'] = Corpus(file_paths, stdin, trusted=trusted)
+    conf['coverage'] = load_coverage(coverage, file_paths)
+
+    artifacts.produce(conf)
+    lib.complete_manifest(manifest, conf['trees'].entries)
+    lib.save_manifest(
+        os.path.join(conf['outdir'], lib.MANIFEST), manifest, tables, options)
+    lib.PROFILER.report(opts, len(args))
 
 if __name__ == '__main__':
     main(sys.argv[1:])
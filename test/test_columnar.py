@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Round trip checks of the columnar tables (see lib/columnar.py). Run with
+python 2 from the top level directory:
+
+    python test/test_columnar.py
+'''
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'table' + lib.columnar.EXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def roundtrip(self, rows):
+        lib.save_columns(self.path, rows)
+        return lib.load_columns(self.path)
+
+    def test_types(self):
+        rows = [
+            (0, 1.5, 2**70, 'a', -2**63),
+            (-3, 0.0, -2**64, 'a b, c', 2**63 - 1),
+            (10**6, 2, 12, '', 7),
+        ]
+        table = self.roundtrip(rows)
+        self.assertEqual(table.types, ['int', 'float', 'bigint', 'str', 'int'])
+        self.assertEqual(len(table), len(rows))
+        self.assertEqual(list(table), rows)
+        for i, row in enumerate(rows):
+            self.assertEqual(table[i], row)
+        self.assertEqual(table[-1], rows[-1])
+        self.assertRaises(IndexError, table.__getitem__, len(rows))
+        for value in table[0]:
+            self.assertNotEqual(type(value).__module__, 'numpy')
+
+    def test_blocks(self):
+        rows = [(i, str(i), 2**64 + i) for i in xrange(1000)]
+        lib.save_columns(self.path, rows)
+        table = lib.load_columns(self.path)
+        table.BLOCK = 7
+        self.assertEqual(list(table), rows)
+
+    def test_empty(self):
+        self.assertEqual(list(self.roundtrip([])), [])
+
+    def test_ragged(self):
+        self.assertRaises(
+            ValueError, lib.save_columns, self.path, [(1, 2), (3,)])
+
+if __name__ == '__main__':
+    unittest.main()
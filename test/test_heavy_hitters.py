@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Checks of the error bounds of merged heavy hitter summaries (see
+lib/heavy_hitters.py). Run with python 2 from the top level directory:
+
+    python test/test_heavy_hitters.py
+'''
+
+import os, sys, random, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib
+
+class TestHeavyHitters(unittest.TestCase):
+
+    def stream(self, rand, n):
+        '''n weighted keys, a few of them heavy.'''
+        for _ in xrange(n):
+            if rand.random() < .3: key = rand.randrange(5)
+            else: key = rand.randrange(5, 500)
+            yield key, rand.randint(1, 4)
+
+    def check(self, summary, truth):
+        total = sum(truth.itervalues())
+        self.assertEqual(summary.total, total)
+        self.assertTrue(summary.error <= total/(summary.k + 1.0))
+        top = dict(summary.top())
+        self.assertTrue(len(top) <= summary.k)
+        for key, count in truth.iteritems():
+            got = top.get(key, 0)
+            self.assertTrue(got <= count <= got + summary.error)
+            if count > summary.error:
+                self.assertTrue(key in top)
+
+    def test_merge(self):
+        rand = random.Random(7)
+        for k in (1, 3, 10, 50):
+            summaries = [lib.HeavyHitters(k) for _ in xrange(4)]
+            truth = dict()
+            for summary in summaries:
+                for key, count in self.stream(rand, 2000):
+                    summary.add(key, count)
+                    truth[key] = truth.get(key, 0) + count
+            merged = lib.HeavyHitters()
+            for summary in summaries:
+                merged.merge(summary)
+            self.check(merged, truth)
+
+    def test_merge_heavy_hitters(self):
+        rand = random.Random(11)
+        a, b, truth = dict(), dict(), dict()
+        for summaries in (a, b):
+            for key, count in self.stream(rand, 1000):
+                name = key % 2
+                summaries.setdefault(name, lib.HeavyHitters(4)).add(key, count)
+                counts = truth.setdefault(name, dict())
+                counts[key] = counts.get(key, 0) + count
+        merged = lib.merge_heavy_hitters(a, b)
+        self.assertEqual(sorted(merged), sorted(truth))
+        for name, summary in merged.iteritems():
+            self.check(summary, truth[name])
+
+if __name__ == '__main__':
+    unittest.main()
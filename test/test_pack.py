@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Author: Tim Henderson
+#Email: tim.tadh@hackthology.com
+#For licensing see the LICENSE file in the top level directory.
+
+'''Round trip checks of packs (see pack.py). Run with python 2 from the top
+level directory:
+
+    python test/test_pack.py
+'''
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ast, pack
+
+TREES = (
+    '3:Expr\n1:Term\n0:NUMBER:1\n0:PLUS:+\n1:Term\n0:NUMBER:2\n',
+    '1:Stmt\n2:Call\n0:NAME:print\n1:Args\n0:STRING:"a:b"\n',
+    '0:Empty\n',
+    '2:Expr\n0:NUMBER:1\n0:NUMBER:1\n',
+)
+
+def decode(symbols):
+    return [ast.decode_flat(text, symbols) for text in TREES]
+
+class TestPack(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trees' + pack.EXT)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check(self, symbols):
+        '''Writes TREES to a pack (with their own symbol table) and reads
+        them back into symbols.'''
+        written = ast.Symbols()
+        self.assertEqual(
+            pack.write_pack(self.path, decode(written), written), len(TREES))
+        p = pack.Pack(self.path, symbols)
+        try:
+            self.assertEqual(len(p), len(TREES))
+            expected = decode(symbols)
+            for i, root in enumerate(expected):
+                got = p[i]
+                for name in pack.ARRAYS:
+                    self.assertEqual(
+                        getattr(got.tree, name), getattr(root.tree, name))
+                self.assertEqual(got.digest(), root.digest())
+                self.assertEqual(str(got), str(root))
+            self.assertEqual(str(p[-1]), str(expected[-1]))
+            self.assertRaises(IndexError, p.__getitem__, len(TREES))
+            self.assertEqual(
+                [str(root) for root in p],
+                [str(root) for root in expected])
+            return p.remap
+        finally:
+            p.close()
+
+    def test_same_symbols(self):
+        self.assertEqual(self.check(ast.Symbols()), None)
+
+    def test_remapped_symbols(self):
+        symbols = ast.Symbols()
+        for label in ('Other', 'NUMBER', 'Term'):
+            symbols.intern(label)
+        self.assertNotEqual(self.check(symbols), None)
+
+    def test_unshared_symbols(self):
+        roots = decode(ast.Symbols()) + decode(ast.Symbols())
+        self.assertRaises(ValueError, pack.write_pack, self.path, roots)
+
+if __name__ == '__main__':
+    unittest.main()